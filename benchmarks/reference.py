@@ -0,0 +1,96 @@
+'''
+The original scalar implementations, kept as the reference the
+optimised engines are benchmarked and checked against.
+
+Copied from the baseline notebooks/payoffSimulation_blog_style.py and
+scripts/investment_calculator.py. The only changes are that module
+state the notebook kept in globals (historicInterest, the payments
+DataFrame) is passed in as arguments and find_interest_rate compares
+calendar dates: the
+notebook's `paymentDate in allDates` is always False for a
+pd.Timestamp against datetime.date on current pandas, which silently
+picked the previous year's rate.
+
+The day-by-day simulate_lifetime_earnings is not copied again: it is
+imported from student_finance.loans, which keeps the notebook's
+version, only taking the median curve and interest rate as
+arguments.
+'''
+
+from datetime import timedelta
+
+import pandas as pd
+
+from student_finance.loans import simulate_lifetime_earnings
+
+
+def simulate(sample_json):
+    '''scripts/investment_calculator.simulate'''
+    year_interest = sample_json["int_rate"]/100
+    monthly_contribution = sample_json["mon_amount"]
+    principal = sample_json["principal"]
+    time = sample_json["time"]
+    for month in range(time*12):
+        principal = principal*(1+(year_interest/12))
+        principal += monthly_contribution
+    return round(principal, 2)
+
+
+def prediction_grid(content):
+    '''The principal x monthly deposit grid built in the /prediction view.'''
+    content = dict(content)
+    payment_matrix = pd.DataFrame(index = range(0,55000,5000),columns=range(0,1050,50))
+    for i in payment_matrix.index:
+        for j in payment_matrix.columns:
+            content['principal'] = int(i)
+            content['mon_amount'] = int(j)
+            payment_matrix.loc[i,j] = simulate(content)
+    binary = payment_matrix.map(lambda x: 0 if x < content['target'] else 1)
+    return payment_matrix, binary
+
+
+def find_interest_rate(paymentDate, historicInterest):
+    paymentDate = paymentDate.date() if isinstance(paymentDate, pd.Timestamp) else paymentDate
+    try:
+        year = paymentDate.year
+        sdate = historicInterest[str(year)]["start"]
+        edate = historicInterest[str(year)]["end"]
+        delta = edate - sdate
+
+        allDates = [sdate + timedelta(days=i) for i in range(delta.days+1)] # create list of all dates in date range sdate to edate
+
+        # Dates in the second semester are in the next calendar year but same academic year
+        # in this case, take the rate of the previous calendar year
+        if paymentDate in allDates:
+            rate = historicInterest[str(year)]["rate"]
+        else:
+            rate = historicInterest[str(year-1)]["rate"]
+    except KeyError: # error for dates in next calendar year but in an academic year which exceeds the last year of the dictionary
+        rate = historicInterest[str(year-1)]["rate"]
+    return rate
+
+
+def graduate_amount(simEnd, employmentStart, myPayments, historicInterest):
+    cumulativeTotal = 0
+    interestRate = 0
+    startDate = myPayments.index.min()
+    if simEnd == "yearEnd":
+        graduationYear = myPayments.index.max().year # assumes that final payment occurs during graduation year
+        yearEnd = str(graduationYear)+"-08-31"
+        endDate = pd.Timestamp(yearEnd) # simulation ends at end of academic year of final payment
+    elif simEnd == "employment":
+        endDate = pd.Timestamp(employmentStart)
+    else:
+        endDate = myPayments.index.max() # simulation ends at final payment
+
+    delta = timedelta(days=1)
+
+    ## Simulate through dates in date period,
+    ## compounding interest each day and adding installments
+    while startDate <= endDate: # simulate interest compounding up to and including last day
+        interestRate = find_interest_rate(startDate, historicInterest)
+        cumulativeTotal *= (1+(interestRate/365)) # apply interest on previous payments before new payment
+        if startDate in myPayments.index: # check if there was a loan instalment on this day
+            cumulativeTotal += myPayments.loc[startDate]["Gross"]
+        startDate += delta
+    return cumulativeTotal
@@ -0,0 +1,299 @@
+'''
+Benchmarks of the simulation paths against the original scalar code.
+
+Times the calculator's simulate, the /prediction grid, graduate_amount
+and principal_at, find_interest_rate and simulate_lifetime_earnings,
+both through the functions callers use and as originally written
+(benchmarks/reference.py), and
+records wall time, peak memory (tracemalloc) and throughput in items
+per second to a JSON file. Seeded inputs are run through both
+implementations and must agree within each case's tolerance. The
+results are compared against benchmarks/baseline.json and the exit
+status is non-zero on a disagreement or a throughput regression.
+Run from the repository root:
+
+    python benchmarks/run_benchmarks.py [--sizes 1000 10000 100000] [--update-baseline] [--profile]
+
+The reference implementations are slow (simulate_lifetime_earnings
+takes about a quarter of a second per trajectory), so they are run on at most
+--reference-limit items of each case and their throughput is taken
+from that subset.
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+OUTPUT = os.path.join(ROOT, 'benchmarks', 'latest.json')
+PAYMENTS_FILE = os.path.join(ROOT, 'data', 'trimmed_data.csv')
+EMPLOYMENT_START = '2019-10-07'
+SIZES = (1000, 10000, 100000)
+REFERENCE_LIMITS = {'calculator_simulate': 10000, 'find_interest_rate': 2000, 'simulate_lifetime_earnings': 5}
+
+
+def relative_error(current, reference):
+    '''Largest absolute difference relative to the reference magnitude (floored at 1).'''
+    current, reference = np.asarray(current, dtype=float), np.asarray(reference, dtype=float)
+    return float(np.max(np.abs(current - reference)/np.maximum(np.abs(reference), 1.0), initial=0.0))
+
+
+def calculator_case(size, limit):
+    from investment_calculator import future_value
+    import reference
+
+    rng = np.random.default_rng(101)
+    scenarios = {'int_rate': rng.integers(0, 11, size), 'mon_amount': rng.integers(0, 1001, size),
+                 'principal': rng.integers(0, 50001, size), 'time': rng.integers(1, 41, size)}
+    n = min(size, limit)
+    reference_inputs = [{'int_rate': int(r), 'mon_amount': int(m), 'principal': int(p), 'time': int(t)}
+                        for r, m, p, t in zip(*(scenarios[k][:n] for k in ('int_rate', 'mon_amount', 'principal', 'time')))]
+    return {'items': size, 'reference_items': n, 'tolerance': 1e-9,
+            'current': lambda: np.round(future_value(scenarios['principal'], scenarios['mon_amount'],
+                                                     scenarios['int_rate'], scenarios['time']), 2),
+            'reference': lambda: [reference.simulate(s) for s in reference_inputs],
+            'compare': lambda current, ref: relative_error(current[:n], ref)}
+
+
+def prediction_grid_case(size, limit):
+    from investment_calculator import simulate_grid
+    import reference
+
+    content = {'int_rate': 7, 'time': 10, 'target': 100000, 'currency': 'GBP'}
+
+    def compare(current, ref):
+        values, meets_target = current[0], current[1]
+        payment_matrix, binary = ref
+        if not np.array_equal(meets_target, binary.values.astype(bool)):
+            return np.inf
+        return relative_error(values, payment_matrix.values.astype(float))
+
+    return {'items': 11*21, 'reference_items': 11*21, 'tolerance': 1e-9,
+            'current': lambda: simulate_grid(content['int_rate'], content['time'], content['target']),
+            'reference': lambda: reference.prediction_grid(content),
+            'compare': compare}
+
+
+def graduate_amount_case(size, limit):
+    import pandas as pd
+    import reference
+    from student_finance.loans import graduate_amount
+    from student_finance.rates import historic_interest, repayment_calendar
+
+    historicInterest = historic_interest()
+    calendar = repayment_calendar()
+    myPayments = pd.read_csv(PAYMENTS_FILE, index_col='PaymentDate', parse_dates=True)
+    return {'items': len(myPayments), 'reference_items': len(myPayments), 'tolerance': 1e-9,
+            'current': lambda: graduate_amount('employment', EMPLOYMENT_START, myPayments, calendar),
+            'reference': lambda: reference.graduate_amount('employment', EMPLOYMENT_START, myPayments, historicInterest),
+            'compare': relative_error}
+
+
+def principal_at_case(size, limit):
+    import pandas as pd
+    import reference
+    from student_finance import accrual
+    from student_finance.rates import historic_interest, repayment_calendar
+
+    historicInterest = historic_interest()
+    calendar = repayment_calendar()
+    myPayments = pd.read_csv(PAYMENTS_FILE, index_col='PaymentDate', parse_dates=True)
+
+    def current():
+        accrual._principal_at.cache_clear() # time reading and accruing the statement, not the memo
+        return accrual.principal_at(PAYMENTS_FILE, EMPLOYMENT_START, calendar)
+
+    return {'items': len(myPayments), 'reference_items': len(myPayments), 'tolerance': 1e-9,
+            'current': current,
+            'reference': lambda: reference.graduate_amount('employment', EMPLOYMENT_START, myPayments, historicInterest),
+            'compare': relative_error}
+
+
+def find_interest_rate_case(size, limit):
+    import reference
+    from student_finance.loans import find_interest_rate
+    from student_finance.rates import historic_interest, repayment_calendar
+
+    historicInterest = historic_interest()
+    calendar = repayment_calendar()
+    first, last = np.datetime64('2012-09-01'), np.datetime64('2021-08-31')
+    dates = (first + np.random.default_rng(101).integers(0, (last - first).astype(int) + 1, size)).astype(object)
+    n = min(size, limit)
+    return {'items': size, 'reference_items': n, 'tolerance': 0.0,
+            'current': lambda: [find_interest_rate(d, calendar) for d in dates],
+            'reference': lambda: [reference.find_interest_rate(d, historicInterest) for d in dates[:n]],
+            'compare': lambda current, ref: relative_error(current[:n], ref)}
+
+
+def lifetime_case(size, limit):
+    import pandas as pd
+    import reference
+    from student_finance.accrual import principal_at
+    from student_finance.engine import simulate_lifetime_earnings_batch
+    from student_finance.rates import repayment_calendar
+    from student_finance.salary_models import monte_carlo_increases
+
+    calendar = repayment_calendar()
+    principal = principal_at(PAYMENTS_FILE, EMPLOYMENT_START, calendar)
+    increases = monte_carlo_increases(np.random.default_rng(101), size)
+    n = min(size, limit)
+    columns = pd.DataFrame(increases[:, :n], index=range(1, increases.shape[0]+1))
+
+    def run_reference():
+        return [reference.simulate_lifetime_earnings(29000, 30, principal, EMPLOYMENT_START,
+                                                   increases=columns[i])
+                for i in range(n)]
+
+    def compare(current, ref):
+        end_values = [balances[-1] for balances, salary, payments in ref]
+        total_payments = [payments for balances, salary, payments in ref]
+        return max(relative_error(current['end_values'][:n], end_values),
+                   relative_error(current['total_payments'][:n], total_payments))
+
+    return {'items': size, 'reference_items': n, 'tolerance': 1e-9,
+            'current': lambda: simulate_lifetime_earnings_batch(29000, 30, principal, EMPLOYMENT_START,
+                                                                increases, calendar=calendar),
+            'reference': run_reference,
+            'compare': compare}
+
+
+## name: (case builder, whether it scales with --sizes)
+CASES = {'calculator_simulate': (calculator_case, True),
+         'prediction_grid': (prediction_grid_case, False),
+         'graduate_amount': (graduate_amount_case, False),
+         'principal_at': (principal_at_case, False),
+         'find_interest_rate': (find_interest_rate_case, True),
+         'simulate_lifetime_earnings': (lifetime_case, True)}
+
+
+def timed(fn, repeats, min_time=0.2):
+    '''
+    Best wall time in seconds over at least repeats calls, repeating
+    sub-millisecond calls until min_time has been spent so their best
+    time is not timer noise. Also returns the last result.
+    '''
+    best, spent, calls = np.inf, 0.0, 0
+    while calls < repeats or spent < min_time:
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best, spent, calls = min(best, elapsed), spent + elapsed, calls + 1
+    return best, result
+
+
+def peak_memory(fn):
+    '''Peak bytes allocated by fn, as traced by tracemalloc (numpy included).'''
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def record(name, size, implementation, items, wall_time, memory):
+    return {'case': name, 'size': size, 'implementation': implementation, 'items': items,
+            'wall_time': wall_time, 'peak_memory': memory, 'throughput': items/wall_time if wall_time else np.inf}
+
+
+def run_case(name, size, repeats, reference_limit, skip_reference):
+    builder, scales = CASES[name]
+    case = builder(size, reference_limit if reference_limit is not None else REFERENCE_LIMITS.get(name))
+    size = size if scales else case['items']
+    wall_time, current = timed(case['current'], repeats)
+    records = [record(name, size, 'current', case['items'], wall_time, peak_memory(case['current']))]
+    agreement = None
+    if not skip_reference:
+        wall_time, ref = timed(case['reference'], 1, min_time=0)
+        records.append(record(name, size, 'reference', case['reference_items'], wall_time, peak_memory(case['reference'])))
+        error = case['compare'](current, ref)
+        agreement = {'case': name, 'size': size, 'items': case['reference_items'], 'max_error': error,
+                     'tolerance': case['tolerance'], 'ok': bool(error <= case['tolerance'])}
+    return records, agreement
+
+
+def compare_to_baseline(records, baseline, tolerance):
+    '''Throughput of each current-implementation record relative to the baseline run.'''
+    previous = {(r['case'], r['size'], r['implementation']): r for r in baseline.get('records', [])}
+    comparisons = []
+    for r in records:
+        old = previous.get((r['case'], r['size'], r['implementation']))
+        if old is None or r['implementation'] != 'current':
+            continue
+        ratio = r['throughput']/old['throughput']
+        comparisons.append({'case': r['case'], 'size': r['size'], 'speedup': ratio,
+                            'memory_ratio': r['peak_memory']/old['peak_memory'] if old['peak_memory'] else np.nan,
+                            'regression': bool(ratio < 1/tolerance)})
+    return comparisons
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--reference-limit', type=int, default=None,
+                        help='items run through the reference code per case (default per case)')
+    parser.add_argument('--skip-reference', action='store_true', help='time the current code only, no agreement checks')
+    parser.add_argument('--output', default=OUTPUT)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help='flag a regression when throughput falls below baseline/tolerance')
+    parser.add_argument('--update-baseline', action='store_true', help='write the results to the baseline file too')
+    parser.add_argument('--profile', action='store_true', help='time the simulation stages and print a table')
+    parser.add_argument('--profile-output', help='also write a cProfile dump of the whole run to this path')
+    args = parser.parse_args(argv)
+
+    from student_finance import profiling
+    profile = args.profile or args.profile_output
+    records, agreements = [], []
+    with (profiling.profile_run(args.profile_output) if profile else nullcontext()):
+        for name in args.cases:
+            for size in (args.sizes if CASES[name][1] else args.sizes[:1]):
+                case_records, agreement = run_case(name, size, args.repeats, args.reference_limit, args.skip_reference)
+                records += case_records
+                if agreement is not None:
+                    agreements.append(agreement)
+                for r in case_records:
+                    print('%-28s %8d %-10s %10.4fs %12.0f/s %10.1f MB' % (r['case'], r['size'], r['implementation'],
+                          r['wall_time'], r['throughput'], r['peak_memory']/1e6))
+    if profile:
+        print(profiling.table())
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    comparisons = compare_to_baseline(records, baseline, args.tolerance)
+
+    output = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor(),
+              'records': records, 'agreement': agreements, 'baseline_comparison': comparisons}
+    if profile:
+        output['profile'] = profiling.summary()
+    for path in [args.output] + ([args.baseline] if args.update_baseline else []):
+        with open(path, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    failed = [a for a in agreements if not a['ok']]
+    regressions = [c for c in comparisons if c['regression']]
+    for a in failed:
+        print('DISAGREES %s (%d): max error %.3g > %.3g' % (a['case'], a['size'], a['max_error'], a['tolerance']))
+    for c in comparisons:
+        print('%-28s %8d %6.2fx baseline throughput%s' % (c['case'], c['size'], c['speedup'],
+                                                          '  REGRESSION' if c['regression'] else ''))
+    return 1 if failed or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
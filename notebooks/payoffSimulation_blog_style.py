@@ -57,9 +57,25 @@ import numpy as np
 from datetime import date, timedelta
 from pandas.tseries.offsets import BMonthEnd
 
-# Scraping interest rates off the web
-import requests
-from bs4 import BeautifulSoup
+# Batched simulation engine
+import sys
+sys.path.append(os.path.join(os.getcwd(), ".."))
+from student_finance.engine import simulate_lifetime_earnings_batch
+from student_finance.repayment_calendar import RepaymentCalendar
+from student_finance.accrual import accrue, accrued_balance, principal_at
+from student_finance.runner import monte_carlo_increases, print_progress, run_adaptive, run_monte_carlo
+from student_finance.results_store import save_results
+from student_finance.salary_models import median_salary, payment_ages
+from student_finance.sweep import sweep_overpayments
+
+# The loan functions below live in the student_finance package (student_finance/loans.py)
+# so they can be imported and run headless, e.g. by the simulate-loans command
+from student_finance.loans import (readPayments, calc_student_finance_PM, find_interest_rate,
+                                   graduate_amount, loanAtEmployment, simulate_lifetime_earnings)
+from student_finance.ledger import LoanLedger
+
+# Offline interest rate and RPI data
+from student_finance.rates import historic_interest, load_rates
 
 # Plotting
 import matplotlib.pyplot as plt
@@ -73,22 +89,10 @@ get_ipython().run_line_magic('matplotlib', 'inline')
 # In[58]:
 
 
-def readPayments(file_name, date_header="PaymentDate"):
-    '''
-    Reads in student finance statement as a pandas dataframe.
-    Function accepts csv file containing dates and amounts of
-    payments made from Student Finance as part of the loan.
-    '''
-    
-    dataLoc = os.path.join(current_wd, "..", "data", file_name)
-    paymentsData = pd.read_csv(dataLoc, index_col=date_header, parse_dates=True)
-    
-    return paymentsData
-
 # Read in my statement detailing university instalments
 current_wd = os.getcwd()
 file_name = "trimmed_data.csv"
-myPayments = readPayments(file_name)
+myPayments = readPayments(file_name) # looks in the repository's data directory
 myPayments.drop("Instalment", axis = 1, inplace = True)
 myPayments.head()
 
@@ -98,19 +102,7 @@ myPayments.head()
 # In[59]:
 
 
-def calc_student_finance_PM(grossSalaryPA):
-    '''
-    Calculates student finance payments per month deducted
-    from gross salary based on thresholds published by
-    Student Finance England.
-    '''
-    grossSalaryPM = grossSalaryPA/12
-    thresholdPM = 2143
-    if grossSalaryPM > thresholdPM:
-        StudentFinPM = 0.09*(grossSalaryPM-thresholdPM)
-    else:
-        StudentFinPM = 0
-    return StudentFinPM
+calc_student_finance_PM(29000)
 
 
 # To calculate how much I owed at the end of university, I need to calculate the interest that is applied to a given instalment, which changes at the start each academic year (September 1st). The first part was to get these rates from the [government website](https://www.gov.uk/guidance/how-interest-is-calculated-plan-2), using a simple web scraper (```BeautifulSoup```) which takes the interest rates for different academic years from the government website and stores them in a dictionary. The second part was to build a function which could take any date during my degree and find the interest rate for payments made at that point in time.
@@ -118,56 +110,16 @@ def calc_student_finance_PM(grossSalaryPA):
 # In[60]:
 
 
-## Web scrape historic interest rates
-
-url = 'https://www.gov.uk/guidance/how-interest-is-calculated-plan-2'
-headers = {'User-Agent': 'Mozilla/5.0'}
-page = requests.get(url, headers=headers)
-soup = BeautifulSoup(page.content, 'html.parser')
-results = soup.find('table')
-table_rows = results.find_all('tr')
-
-# Store interest rates in dictionary of academic years
-historicInterest = {}
-for tr in table_rows:
-    td = tr.find_all('td')
-    row = [i.text for i in td]
-    if len(row) > 0:
-        row[0] = row[0].split('to')
-        row[0][0] = pd.Timestamp(row[0][0])
-        row[0][1] = pd.Timestamp(row[0][1])
-        year = str(row[0][0].year)
-        historicInterest.setdefault(year, 0)
-        historicInterest[year] = {}
-        historicInterest[year].setdefault("start", 0)
-        historicInterest[year]["start"] = row[0][0].date()
-        historicInterest[year].setdefault("end", 0)
-        historicInterest[year]["end"] = row[0][1].date()
-        historicInterest[year].setdefault("rate", 0)
-        historicInterest[year]["rate"] = float(row[1][:-1])/100
-
-def find_interest_rate(paymentDate):
-    '''
-    Finds interest rate for a date which falls in 
-    a given academic year using a lookup dictionary.
-    '''
-    try:
-        year = paymentDate.year
-        sdate = historicInterest[str(year)]["start"]
-        edate = historicInterest[str(year)]["end"]
-        delta = edate - sdate
-    
-        allDates = [sdate + timedelta(days=i) for i in range(delta.days+1)] # create list of all dates in date range sdate to edate
-        
-        # Dates in the second semester are in the next calendar year but same academic year
-        # in this case, take the rate of the previous calendar year
-        if paymentDate in allDates:
-            rate = historicInterest[str(year)]["rate"]
-        else:
-            rate = historicInterest[str(year-1)]["rate"]
-    except KeyError: # error for dates in next calendar year but in an academic year which exceeds the last year of the dictionary
-        rate = historicInterest[str(year-1)]["rate"]
-    return rate
+## Historic interest rates, from the Plan 2 table on the
+## [government website](https://www.gov.uk/guidance/how-interest-is-calculated-plan-2)
+## vendored in data/plan2_interest_rates.csv (no network needed)
+rates = load_rates()
+historicInterest = historic_interest(rates)
+
+# Rate-change boundaries, cumulative compounding factors and payment dates are built once
+calendar = RepaymentCalendar.from_historic_interest(historicInterest)
+
+find_interest_rate(date(2015, 2, 4), calendar) # a bisection over the academic year start dates
 
 
 # In[61]:
@@ -182,59 +134,20 @@ import pprint as pp
 # In[62]:
 
 
-def graduate_amount(simEnd, employmentStart, myPayments=None): # simEnd argument ends simulation either on the last payment in data, at the end of graduation academic year or at commencement of employment
-    '''
-    calculate total student debt owed at employment, 
-    end of graduation year or at final instalment manually (using simEnd)
-    Alternatively can take manually input total
-    '''
-    
-    cumulativeTotal = 0
-    interestRate = 0
-    if myPayments is not None:
-        startDate = myPayments.index.min()
-        if simEnd == "yearEnd":
-            graduationYear = myPayments.index.max().year # assumes that final payment occurs during graduation year
-            yearEnd = str(graduationYear)+"-08-31"
-            endDate = pd.Timestamp(yearEnd) # simulation ends at end of academic year of final payment
-        elif simEnd == "employment":
-            endDate = pd.Timestamp(employmentStart)
-        else:
-            endDate = myPayments.index.max() # simulation ends at final payment
-
-        delta = timedelta(days=1)
-        
-        ## Simulate through dates in date period, 
-        ## compounding interest each day and adding installments
-        
-        while startDate <= endDate: # simulate interest compounding up to and including last day
-            interestRate = find_interest_rate(startDate)
-            cumulativeTotal *= (1+(interestRate/365)) # apply interest on previous payments before new payment
-            if startDate in myPayments.index: # check if there was a loan instalment on this day
-                cumulativeTotal += myPayments.loc[startDate]["Gross"]
-            startDate += delta                
-            
-    else:
-        print("Please enter your net total of Student Debt at graduation")
-        cumulativeTotal = input()
-    return cumulativeTotal
+graduate_amount("employment", "2019-10-07", myPayments, calendar) # each instalment compounded in closed form over the calendar's rate segments
+
+# A ledger reads new statement lines as they are added and keeps the balance at each
+# rate change, so a balance on any date only replays the entries since the last one
+ledger = LoanLedger(calendar)
+ledger.ingest(os.path.join(current_wd, "..", "data", file_name))
+ledger.balance_at("2019-10-07"), ledger.balance_at("2017-08-31")
 
 
 # In[63]:
 
 
-def loanAtEmployment(principal, principal_date, employment_start):
-    '''when payment data is absent, plug in last statement amount and date'''
-    endDate = pd.Timestamp(employment_start)
-    startDate = principal_date
-    cumulativeTotal = principal
-    delta = timedelta(days=1)
-    
-    while startDate <= endDate: # up to and including final payment
-        interestRate = find_interest_rate(startDate)
-        cumulativeTotal *= (1+(interestRate/365)) # apply interest on previous payments before new payment
-        startDate += delta
-    return cumulativeTotal
+# when payment data is absent, plug in last statement amount and date
+# loanAtEmployment(principal, principal_date, "2019-10-07", calendar)
 
 
 # ### The Main Function!
@@ -243,54 +156,12 @@ def loanAtEmployment(principal, principal_date, employment_start):
 # In[64]:
 
 
-def simulate_lifetime_earnings(grossSalaryPA, N, principal, employment_start, method="monte carlo", increases=None):
-    '''
-    Simulates payment of student debt across career based 
-    on monthly tax payments according to estimated salary 
-    and simultaneous compounding interest of loan
-    '''
-    
-    salary = [] # store salary trajectory for plotting
-    payments_towards = 0 # cumulative total of payments made towards loan across career
-    salary.append(grossSalaryPA)
-    
-    ## Simulation start and end points
-    today = pd.Timestamp(employment_start)
-    start = today
-    edate = today + timedelta(days=N*365) # N years of payments
-    delta = timedelta(days=1)
-    offset = BMonthEnd() # date each month that tax is paid
-    
-    cumulativeTotal = principal
-    cumulativeList = [] # store the value of the loan at each timestep
-    cumulativeList.append(cumulativeTotal)
-    
-    ## Simulate through N years of payments
-    ## interest compounds each day
-    ## payment made on last working day of the month
-    while today <= edate:
-        if method == "monte carlo" and increases is not None:
-            if ((today - start).days/365)%5 == 0 and (today - start).days > 0:
-                grossSalaryPA *= increases[(today - start).days/365/5]
-                
-        elif method == "monte carlo" and increases is None:
-            print("Please supply monte carlo simulated salary increases")
-            
-        if method == "median":
-            if (today - start).days%365 == 0 and (today - start).days/365 in male_HE.index:
-                grossSalaryPA = male_HE.loc[(today - start).days/365]['Earning']
-
-        cumulativeTotal *= (1+(0.055/365)) # apply interest on previous payments before new payment
-        
-        if today == offset.rollforward(today) and today.month == offset.rollforward(today).month: # if today in sim is last working day
-            cumulativeTotal -= calc_student_finance_PM(grossSalaryPA) # payment made to student finance based on gross salary
-            payments_towards += calc_student_finance_PM(grossSalaryPA) # this payment is added to cumulative sum
-            cumulativeList.append(cumulativeTotal)
-            salary.append(grossSalaryPA)
-            
-        today += delta
-
-    return cumulativeList, salary, payments_towards
+# Real median earnings of male graduates for each year of the repayment period, used by method = "median"
+male_HE = pd.DataFrame({"Earning": median_salary("men", "HE", payment_ages(22, np.arange(31)*365))})
+
+# The original day-by-day simulator, used below to check the batched engine
+sim, sal, net_payments = simulate_lifetime_earnings(29000, 30, graduate_amount("employment", "2019-10-07", myPayments, calendar),
+                                                    "2019-10-07", method = "median", median = male_HE["Earning"])
 
 
 # As you can see in the plot above, the median male graduate's salary does not increase fast enough in the early years/over the 30 years to ever overcome the rate of compounding of the loan interest. Thus, the loan's net value spirals upwards, and they never pay it off. At 30 years, the loan will be cancelled. However, there are many confounding variables here - e.g. this is averaged across subjects and university (e.g. [Russell Group](https://russellgroup.ac.uk/about/) and nonRG), which both have very large variance in later life earnings. So this should be looked at purely as an example of the simulation.
@@ -346,33 +217,63 @@ cycol = cycle('bgrcmk')
 # ax[1].set_ylabel("Value")
 # ax[1].yaxis.label.set_color('black')
 # ax[1].set_title('50 MC-simulated salary trajectories')
-from IPython.display import clear_output
-
 salary_levels = 6
-np.random.seed(101)
 startingSal = 29000
 sims = 100000
-monte_carlo_increases = pd.DataFrame(np.row_stack([np.random.normal(loc=x, scale=0.1,size=(1,sims)) for x in np.linspace(.1,.4,salary_levels)[::-1]]))
-end_values = []
-total_payments = []
-monte_carlo_increases += 1
-monte_carlo_increases.index += 1
-totalLoan_values = 0
-import time
-start = time.time()
-for column in range(sims):
-    clear_output(wait=True)
-#     print(monte_carlo_increases[column])
+# Loan value at employment, computed once per statement, employment date and rate table
+principal = principal_at(os.path.join(current_wd, "..", "data", file_name), "2019-10-07", calendar)
+
+# Check the batched engine against the day-by-day simulator on a seeded subset
+check_increases = pd.DataFrame(monte_carlo_increases(np.random.default_rng(101), 20, salary_levels),
+                               index = range(1, salary_levels+1))
+check = simulate_lifetime_earnings_batch(grossSalaryPA = startingSal, N = 30, principal = principal,
+                                         employment_start = "2019-10-07",
+                                         increases = check_increases,
+                                         return_trajectories = True, calendar = calendar)
+for column in range(20):
     sim, sal, net_payments = simulate_lifetime_earnings(grossSalaryPA = startingSal,
                                     N = 30,
-                                    principal = graduate_amount(simEnd = "employment", employmentStart = "2019-10-07", myPayments = myPayments), 
-                                    employment_start = "2019-10-07", 
+                                    principal = principal,
+                                    employment_start = "2019-10-07",
                                     method = "monte carlo",
-                                    increases = monte_carlo_increases[column])
-    end_values.append(sim[-1])
-    total_payments.append(net_payments)
-    if (100*column/sims)%5 == 0:
-        print("current progress ", column/sims*100, r"% after ", time.time()-start, "seconds")
+                                    increases = check_increases[column])
+    assert np.allclose(sim, check["balances"][:, column])
+    assert np.isclose(net_payments, check["total_payments"][column])
+
+# Chunks are seeded from SeedSequence(101), so results do not depend on the number of workers
+results = run_monte_carlo(grossSalaryPA = startingSal,
+                          N = 30,
+                          principal = principal,
+                          employment_start = "2019-10-07",
+                          sims = sims,
+                          seed = 101,
+                          salary_levels = salary_levels,
+                          calendar = calendar,
+                          progress = print_progress,
+                          record = {"sample": 50}) # 50 representative paths and monthly percentile bands
+summary = results["aggregate"].summary() # pass per_trajectory = True to also keep every end value and payment total
+
+# Store the run as .npy arrays with a manifest of the assumptions it was made with
+save_results(os.path.join(current_wd, "..", "results", "monte_carlo_run"), results,
+             parameters = {"seed": 101, "sims": sims, "startingSal": startingSal, "salary_levels": salary_levels,
+                           "employment_start": "2019-10-07", "N": 30, "principal": principal,
+                           "repayment_interest_rate": 0.055, "historicInterest": historicInterest})
+
+# Fan charts from the recorder: 5-95% and 25-75% bands of every trajectory, and the 50 sampled paths
+bands = results["trajectories"].percentile_bands()
+index, balance_paths, salary_paths = results["trajectories"].trajectories()
+fig, ax = plt.subplots(2, 1, figsize = (16, 12))
+for axis, name, paths, title in ((ax[0], "balances", balance_paths, "Loan value"), (ax[1], "salaries", salary_paths, "Salary")):
+    axis.fill_between(bands["months"], bands[name + "_P5"], bands[name + "_P95"], alpha = 0.2, label = "5-95%")
+    axis.fill_between(bands["months"], bands[name + "_P25"], bands[name + "_P75"], alpha = 0.4, label = "25-75%")
+    axis.plot(bands["months"], paths.T, color = "grey", linewidth = 0.3)
+    axis.plot(bands["months"], bands[name + "_P50"], color = "black", label = "median")
+    axis.set_xlabel("Elapsed months")
+    axis.set_ylabel("Value")
+    axis.set_title("%s of %d MC-simulated salary trajectories" % (title, sims))
+    axis.grid(axis = "y")
+    axis.legend(loc = "upper left")
+ax[0].axhline(y = 0, color = "r", linestyle = "--")
 #     col = next(cycol)
 #     ax[1].plot(sal, label = "Salary")#, color=col)
 #     ax[0].plot(sim, label = "Net value of Student Loan")#,color=col)
@@ -398,7 +299,27 @@ for column in range(sims):
 # In[69]:
 
 
-np.mean(total_payments)
+summary["total_payments_mean"], summary["end_value_mean"], summary["paid_off_fraction"]
+
+# How many simulations were actually needed? Draw antithetic batches until the 95% intervals
+# are within £100 on the means and 0.2 percentage points on the paid off fraction
+adaptive = run_adaptive(startingSal, 30, principal, "2019-10-07",
+                        tolerance = {"end_value_mean": 100, "paid_off_fraction": 0.002, "total_payments_mean": 100},
+                        antithetic = True, max_sims = sims, seed = 101, calendar = calendar)
+adaptive["sims"], adaptive["estimates"]
+
+
+# In[70]:
+
+
+# Question 2: voluntary overpayments, every strategy run on the same salary draws (common random numbers)
+strategies = [{"name": "no overpayment"},
+              {"name": "£5k lump sum in 2021", "lump_sum": 5000, "lump_sum_date": "2021-01-01"},
+              {"name": "£100 extra a month", "extra_monthly": 100},
+              {"name": "£200 extra a month", "extra_monthly": 200}]
+sweep = sweep_overpayments(strategies, startingSal, 30, principal, "2019-10-07", sims = sims, seed = 101,
+                           salary_levels = salary_levels, calendar = calendar)
+pd.DataFrame({name: result["summary"] for name, result in sweep.items()})
 
 
 # ## Results
@@ -0,0 +1,103 @@
+'''
+Start-up time and per-request latency of the heatmap renderers.
+
+Compares the original path (pandas + seaborn on pyplot global state,
+imported at start-up) with heatmap_renderer (Figure API, matplotlib
+imported on first use). Run from the scripts directory:
+
+    python compare_renderers.py [--repeats 20] [--resolution 11 21]
+'''
+import argparse
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+LEGACY_IMPORTS = '''
+import flask, flask_wtf, wtforms, numpy, pandas
+import seaborn
+import matplotlib.pyplot
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+'''
+CURRENT_IMPORTS = 'import investment_calculator'
+
+
+def startup_time(code, repeats):
+    '''Best wall time in seconds of a fresh interpreter running code.'''
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def render_legacy(meets_target, principals, deposits):
+    '''The original seaborn/pyplot renderer from the /prediction view.'''
+    import pandas as pd
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+    from matplotlib.colors import LinearSegmentedColormap
+
+    binary = pd.DataFrame(meets_target.astype(int), index=principals, columns=deposits)
+    fig = plt.figure()
+    colors = ((223/255, 221/255, 221/255), (0.298, 0.686, 0.314))
+    cmap = LinearSegmentedColormap.from_list('Custom', colors, len(colors))
+    ax = sns.heatmap(binary,linewidths=0.3, linecolor='#041A32', cmap=cmap)
+    ax.set_xlabel("Monthly deposit", color="white")
+    ax.set_ylabel("Principal", color="white")
+    sns.despine()
+    ax.tick_params(axis='y', which='both', colors='white', width=5)
+    ax.tick_params(axis='x', which='both', colors='white', width=5)
+    colorbar = ax.collections[0].colorbar
+    colorbar.set_ticks([0.25,0.75])
+    colorbar.set_ticklabels(['Miss target', 'Meet target'])
+    colorbar.ax.tick_params(colors="white")
+    plt.ylim(len(principals),0)
+    plt.tight_layout()
+    fig.patch.set_facecolor('#041A32')
+    pngImage = BytesIO()
+    FigureCanvas(fig).print_png(pngImage)
+    plt.close(fig)
+    return pngImage.getvalue()
+
+
+def latency(render, args, repeats):
+    '''Median wall time in seconds of render(*args), after one warm-up call.'''
+    render(*args)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        render(*args)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times)//2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--resolution', type=int, nargs=2, default=(11, 21))
+    args = parser.parse_args()
+
+    import matplotlib
+    matplotlib.use('Agg')
+    from investment_calculator import axis_labels, simulate_grid
+    from heatmap_renderer import render_target_heatmap
+
+    values, meets_target, principals, deposits = simulate_grid(7, 10, 100000, resolution=args.resolution)
+    render_args = (meets_target, axis_labels(principals), axis_labels(deposits))
+
+    startup_repeats = max(1, args.repeats//4)
+    rows = [('start-up (s)', startup_time(LEGACY_IMPORTS, startup_repeats), startup_time(CURRENT_IMPORTS, startup_repeats)),
+            ('render %dx%d (s)' % tuple(args.resolution),
+             latency(render_legacy, render_args, args.repeats), latency(render_target_heatmap, render_args, args.repeats))]
+
+    print('%-20s %12s %12s %8s' % ('', 'seaborn', 'figure', 'speedup'))
+    for name, legacy, current in rows:
+        print('%-20s %12.4f %12.4f %7.1fx' % (name, legacy, current, legacy/current))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+from io import BytesIO
+import math
+
+import numpy as np
+
+BACKGROUND = '#041A32'
+MISS_COLOUR = (223/255, 221/255, 221/255)
+MEET_COLOUR = (0.298, 0.686, 0.314)
+MAX_TICK_LABELS = 21
+
+
+def tick_positions(n):
+    '''Cell-centre tick positions, thinned so at most MAX_TICK_LABELS are drawn.'''
+    step = max(1, math.ceil(n/MAX_TICK_LABELS))
+    return np.arange(0, n, step)
+
+
+def render_target_heatmap(meets_target, principal_labels, deposit_labels, dpi=100):
+    '''
+    Renders the meets/misses target grid as PNG bytes using the
+    object-oriented matplotlib Figure API only, so no pyplot global
+    state is touched and concurrent requests are safe. matplotlib is
+    imported on first use to keep app start-up fast.
+    '''
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.colors import ListedColormap
+    from matplotlib.figure import Figure
+
+    fig = Figure(dpi=dpi)
+    FigureCanvasAgg(fig)
+    fig.patch.set_facecolor(BACKGROUND)
+    ax = fig.add_subplot()
+
+    cmap = ListedColormap([MISS_COLOUR, MEET_COLOUR])
+    rows, columns = meets_target.shape
+    edge_width = 0.3 if max(rows, columns) <= 60 else 0 # grid lines would swamp fine grids
+    mesh = ax.pcolormesh(meets_target.astype(np.uint8), cmap=cmap, vmin=0, vmax=1,
+                         edgecolors=BACKGROUND, linewidth=edge_width)
+    ax.set_xlim(0, columns)
+    ax.set_ylim(rows, 0) # smallest principal at the top, as the original seaborn plot
+
+    xticks, yticks = tick_positions(columns), tick_positions(rows)
+    ax.set_xticks(xticks + 0.5)
+    ax.set_xticklabels([str(deposit_labels[i]) for i in xticks], rotation=90)
+    ax.set_yticks(yticks + 0.5)
+    ax.set_yticklabels([str(principal_labels[i]) for i in yticks])
+    ax.set_xlabel("Monthly deposit", color="white")
+    ax.set_ylabel("Principal", color="white")
+    ax.tick_params(axis='both', which='both', colors='white', width=5)
+    for side in ('top', 'right'):
+        ax.spines[side].set_visible(False)
+    for side in ('bottom', 'left'):
+        ax.spines[side].set_linewidth(1)
+        ax.spines[side].set_color(BACKGROUND)
+
+    colorbar = fig.colorbar(mesh, ax=ax)
+    colorbar.set_ticks([0.25, 0.75])
+    colorbar.set_ticklabels(['Miss target', 'Meet target'])
+    colorbar.ax.tick_params(colors="white")
+    colorbar.outline.set_visible(False)
+    fig.tight_layout()
+
+    pngImage = BytesIO()
+    fig.canvas.print_png(pngImage)
+    return pngImage.getvalue()
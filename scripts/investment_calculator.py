@@ -1,20 +1,43 @@
-from flask import Flask, render_template, session, url_for, redirect
+from flask import Flask, render_template, session, url_for, redirect, abort, jsonify, make_response, request, g
 import numpy as np 
-import pandas as pd 
 from flask_wtf import FlaskForm
 from wtforms import TextField, SubmitField
 from wtforms.validators import NumberRange
-import seaborn as sns
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.colors import LinearSegmentedColormap
-from matplotlib.figure import Figure
-from io import StringIO, BytesIO
-import base64
-from PIL import Image
+import json
+import os
+import sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from student_finance import profiling
+
+from lru_cache import LRUCache, cache_key
+from heatmap_renderer import render_target_heatmap # imports matplotlib on first render
+from jobs import JobQueue
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'mysecretkey'
+# Bounds (inclusive) and number of points of the principal x monthly deposit heatmap
+app.config['GRID_PRINCIPAL_RANGE'] = (0, 50000)
+app.config['GRID_DEPOSIT_RANGE'] = (0, 1000)
+app.config['GRID_RESOLUTION'] = (11, 21)
+app.config['HEATMAP_CACHE_SIZE'] = 128
+app.config['API_MAX_BATCH'] = 1000
+app.config['API_MAX_YEARS'] = 100
+app.config['API_MAX_GRID_POINTS'] = 1000000 # scenarios x grid points of one /api/simulate request with a grid
+# Background jobs (POST /jobs): worker processes, or threads in this process with JOBS_IN_PROCESS
+app.config['JOBS_IN_PROCESS'] = False
+app.config['JOBS_MAX_WORKERS'] = None # every CPU
+app.config['JOBS_CACHE_SIZE'] = 256
+app.config['JOBS_MAX_SIMS'] = 1000000
+app.config['JOBS_MAX_CHUNK_SIZE'] = 20000 # a chunk holds a (12*years x chunk_size) salary matrix
+app.config['JOBS_MAX_SALARY_LEVELS'] = 20
+app.config['JOBS_MAX_GRID_POINTS'] = 4000000
+app.config['JOBS_GRID_ROWS_PER_TASK'] = 100
+
+heatmap_cache = LRUCache(maxsize=app.config['HEATMAP_CACHE_SIZE'])
+job_queue = JobQueue(max_workers=app.config['JOBS_MAX_WORKERS'], in_process=app.config['JOBS_IN_PROCESS'],
+                     maxsize=app.config['JOBS_CACHE_SIZE'])
 
 # def simulate(principal, time, year_interest, monthly_contribution):
 def simulate(sample_json):
@@ -34,6 +57,118 @@ def simulate(sample_json):
         principal += monthly_contribution
     return round(principal, 2)
 
+def future_value(principal, monthly_contribution, int_rate, time):
+    '''
+    Closed form of the loop in simulate: the principal compounded
+    monthly for time years plus the future value of the monthly
+    contributions (an annuity). Broadcasts over numpy arrays.
+    '''
+    rate = np.asarray(int_rate, dtype=float)/100/12
+    months = np.asarray(time)*12
+    growth = (1+rate)**months
+    annuity = np.where(rate == 0, months, (growth-1)/np.where(rate == 0, 1, rate))
+    return principal*growth + monthly_contribution*annuity
+
+@profiling.timed('grid')
+def simulate_grid(int_rate, time, target, principal_range=(0, 50000), deposit_range=(0, 1000), resolution=(11, 21)):
+    '''
+    Evaluates simulate over a principal x monthly deposit grid in one
+    broadcast. Ranges are inclusive and resolution gives the number of
+    principals and deposits. Returns the end values (rounded as in
+    simulate), the meets-target mask and the two axes.
+    '''
+    principals = np.linspace(principal_range[0], principal_range[1], resolution[0])
+    deposits = np.linspace(deposit_range[0], deposit_range[1], resolution[1])
+    values = np.round(future_value(principals[:, None], deposits[None, :], int_rate, time), 2)
+    return values, values >= target, principals, deposits
+
+SCENARIO_FIELDS = ('int_rate', 'mon_amount', 'principal', 'time', 'target')
+
+def validate_scenarios(payload, max_batch=1000, max_years=100, grid_points=0, max_grid_points=1000000):
+    '''
+    Checks an /api/simulate request body before anything is computed.
+    Accepts one scenario object, a list of them, or {"scenarios": [...]}.
+    grid_points is the size of the grid each scenario is evaluated
+    over (0 without one); the batch may hold at most max_grid_points
+    of them in all. Returns (scenarios, errors); errors is a list of
+    messages.
+    '''
+    if isinstance(payload, dict) and 'scenarios' in payload:
+        payload = payload['scenarios']
+    scenarios = payload if isinstance(payload, list) else [payload]
+    if not scenarios:
+        return [], ['no scenarios given']
+    if len(scenarios) > max_batch:
+        return [], ['at most %d scenarios per request, got %d' % (max_batch, len(scenarios))]
+    if len(scenarios)*grid_points > max_grid_points:
+        return [], ['at most %d scenarios per request with a grid of %d points, got %d'
+                    % (max_grid_points//grid_points, grid_points, len(scenarios))]
+
+    errors = []
+    for i, scenario in enumerate(scenarios):
+        if not isinstance(scenario, dict):
+            errors.append('scenario %d: expected an object' % i)
+            continue
+        for field in SCENARIO_FIELDS:
+            value = scenario.get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+                errors.append('scenario %d: %s must be a number' % (i, field))
+            elif field != 'target' and value < 0:
+                errors.append('scenario %d: %s must not be negative' % (i, field))
+        time = scenario.get('time')
+        if isinstance(time, (int, float)) and not isinstance(time, bool) and np.isfinite(time):
+            if time != int(time):
+                errors.append('scenario %d: time must be a whole number of years' % i)
+            elif time > max_years:
+                errors.append('scenario %d: time must be at most %d years' % (i, max_years))
+        if 'currency' in scenario and not isinstance(scenario['currency'], str):
+            errors.append('scenario %d: currency must be a string' % i)
+    return scenarios, errors
+
+@profiling.timed('api batch')
+def simulate_batch(scenarios, grid=None):
+    '''
+    Evaluates a batch of validated scenarios in one vectorised pass.
+    Returns one dict per scenario with the final balance (as simulate),
+    whether and after how many months the target is reached, and, when
+    grid is a (principal_range, deposit_range, resolution) tuple, the
+    meets-target mask over that grid.
+    '''
+    fields = {field: np.array([scenario[field] for scenario in scenarios], dtype=float) for field in SCENARIO_FIELDS}
+    months = (fields['time']*12).astype(int)
+    final = np.round(future_value(fields['principal'], fields['mon_amount'], fields['int_rate'], fields['time']), 2)
+
+    ## balance after every month up to the longest horizon, one row per scenario
+    elapsed = np.arange(months.max()+1)
+    balances = np.round(future_value(fields['principal'][:, None], fields['mon_amount'][:, None],
+                                     fields['int_rate'][:, None], elapsed[None, :]/12), 2)
+    reached = (balances >= fields['target'][:, None]) & (elapsed[None, :] <= months[:, None])
+    months_to_target = np.where(reached.any(axis=1), reached.argmax(axis=1), -1)
+
+    if grid is not None:
+        principal_range, deposit_range, resolution = grid
+        principals = np.linspace(principal_range[0], principal_range[1], resolution[0])
+        deposits = np.linspace(deposit_range[0], deposit_range[1], resolution[1])
+        grid_values = np.round(future_value(principals[None, :, None], deposits[None, None, :],
+                                            fields['int_rate'][:, None, None], fields['time'][:, None, None]), 2)
+        masks = grid_values >= fields['target'][:, None, None]
+
+    results = []
+    for i, scenario in enumerate(scenarios):
+        result = {'final_balance': float(final[i]),
+                  'meets_target': bool(final[i] >= fields['target'][i]),
+                  'months_to_target': int(months_to_target[i]) if months_to_target[i] >= 0 else None}
+        if 'currency' in scenario:
+            result['currency'] = scenario['currency']
+        if grid is not None:
+            result['grid_mask'] = masks[i].astype(int).tolist()
+        results.append(result)
+    return results
+
+def axis_labels(axis):
+    '''Grid axis as ints when every point is a whole number, for tick labels.'''
+    return axis.astype(int) if np.all(axis == np.round(axis)) else axis.round(2)
+
 class FinanceForm(FlaskForm):
     int_rate = TextField("Interest Rate %", id='myfont')
     mon_amount = TextField("Monthly Deposit")
@@ -58,6 +193,35 @@ def index():
         return redirect(url_for("prediction"))
     return render_template('home.html', form=form)
 
+@profiling.timed('heatmap render')
+def render_heatmap(meets_target, principals, deposits):
+    '''Renders the meets/misses target grid as PNG bytes.'''
+    return render_target_heatmap(meets_target, axis_labels(principals), axis_labels(deposits))
+
+HEATMAP_FIELDS = ('int_rate', 'time', 'target', 'currency')
+
+def heatmap_key(content):
+    '''Cache key (and ETag) of the heatmap for the inputs in content and the configured grid.'''
+    grid_config = (app.config['GRID_PRINCIPAL_RANGE'], app.config['GRID_DEPOSIT_RANGE'], app.config['GRID_RESOLUTION'])
+    return cache_key(int_rate=content['int_rate'], time=content['time'], target=content['target'],
+                     currency=content['currency'], grid=json.dumps(grid_config))
+
+def heatmap_entry(content):
+    '''Cached heatmap and grid for the rate, time, target and currency in content.'''
+    grid_config = (app.config['GRID_PRINCIPAL_RANGE'], app.config['GRID_DEPOSIT_RANGE'], app.config['GRID_RESOLUTION'])
+    key = heatmap_key(content)
+
+    def create():
+        values, meets_target, principals, deposits = simulate_grid(content['int_rate'], content['time'], content['target'],
+                                                                  principal_range=grid_config[0],
+                                                                  deposit_range=grid_config[1],
+                                                                  resolution=grid_config[2])
+        return {'png': render_heatmap(meets_target, principals, deposits),
+                'values': values, 'meets_target': meets_target,
+                'principals': principals, 'deposits': deposits}
+
+    return key, heatmap_cache.get_or_create(key, create)
+
 @app.route('/prediction')
 def prediction():
     content = {}
@@ -70,51 +234,271 @@ def prediction():
     content['currency'] = str(session['currency'])
 
     results = simulate(content)
+    key, entry = heatmap_entry(content)
+
+    image = url_for('heatmap', **{field: content[field] for field in HEATMAP_FIELDS})
+    return render_template('prediction.html',results=results, image=image)
+
+def heatmap_inputs(args):
+    '''The heatmap inputs of a query string, or None if any is missing or invalid.'''
+    content = {'currency': args.get('currency', '')}
+    for field in ('int_rate', 'time', 'target'):
+        try:
+            content[field] = float(args[field])
+        except (KeyError, ValueError):
+            return None
+        if not np.isfinite(content[field]):
+            return None
+    if not 0 <= content['time'] <= app.config['API_MAX_YEARS']:
+        return None
+    return content
+
+@app.route('/heatmap.png')
+def heatmap():
+    '''
+    The heatmap for the int_rate, time, target and currency query
+    arguments. It is rebuilt on a cache miss, so the URL works after
+    an eviction or restart and on any worker; the cache key is the
+    ETag.
+    '''
+    content = heatmap_inputs(request.args)
+    if content is None:
+        abort(400)
+    key = heatmap_key(content)
+    if key in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        key, entry = heatmap_entry(content)
+        response = make_response(entry['png'])
+        response.headers['Content-Type'] = 'image/png'
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    response.set_etag(key)
+    return response
+
+@app.route('/api/simulate', methods=['POST'])
+def api_simulate():
+    '''
+    JSON body: a scenario {"int_rate", "mon_amount", "principal",
+    "time", "target"[, "currency"]}, a list of scenarios, or
+    {"scenarios": [...], "grid": true}. Responds with one result per
+    scenario; with "grid" each also carries its meets-target mask over
+    the configured principal x deposit grid.
+    '''
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'errors': ['request body must be JSON']}), 400
+    grid = None
+    if isinstance(payload, dict) and payload.get('grid'):
+        grid = (app.config['GRID_PRINCIPAL_RANGE'], app.config['GRID_DEPOSIT_RANGE'], app.config['GRID_RESOLUTION'])
+    scenarios, errors = validate_scenarios(payload, max_batch=app.config['API_MAX_BATCH'],
+                                           max_years=app.config['API_MAX_YEARS'],
+                                           grid_points=grid[2][0]*grid[2][1] if grid is not None else 0,
+                                           max_grid_points=app.config['API_MAX_GRID_POINTS'])
+    if errors:
+        return jsonify({'errors': errors}), 400
+    response = {'results': simulate_batch(scenarios, grid=grid)}
+    if grid is not None:
+        principals = np.linspace(grid[0][0], grid[0][1], grid[2][0])
+        deposits = np.linspace(grid[1][0], grid[1][1], grid[2][1])
+        response['grid'] = {'principals': axis_labels(principals).tolist(), 'deposits': axis_labels(deposits).tolist()}
+    return jsonify(response)
+
+@app.route('/heatmap/stats')
+def heatmap_stats():
+    return jsonify(heatmap_cache.stats())
+
+def grid_rows(principals, deposits, int_rate, time, target):
+    '''Meets-target mask of a block of grid rows, one row per principal (a job task).'''
+    values = np.round(future_value(principals[:, None], deposits[None, :], int_rate, time), 2)
+    return values >= target
+
+def grid_job(scenario):
+    '''
+    Tasks and finish of a "grid" job: the meets-target mask of
+    simulate_grid over a principal x deposit grid, split into blocks
+    of rows. scenario has int_rate, time and target, and optionally
+    principal_range, deposit_range and resolution (the configured grid
+    by default). Raises ValueError for an invalid scenario.
+    '''
+    if not isinstance(scenario, dict):
+        raise ValueError('scenario must be an object')
+    for field in ('int_rate', 'time', 'target'):
+        value = scenario.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+            raise ValueError('%s must be a number' % field)
+    if not 0 <= scenario['time'] <= app.config['API_MAX_YEARS']:
+        raise ValueError('time must be between 0 and %d years' % app.config['API_MAX_YEARS'])
+    principal_range = scenario.get('principal_range', app.config['GRID_PRINCIPAL_RANGE'])
+    deposit_range = scenario.get('deposit_range', app.config['GRID_DEPOSIT_RANGE'])
+    resolution = scenario.get('resolution', app.config['GRID_RESOLUTION'])
+    for name, pair in (('principal_range', principal_range), ('deposit_range', deposit_range), ('resolution', resolution)):
+        if (not isinstance(pair, (list, tuple)) or len(pair) != 2
+                or any(isinstance(v, bool) or not isinstance(v, (int, float)) or not np.isfinite(v) for v in pair)):
+            raise ValueError('%s must be a pair of numbers' % name)
+    if any(n != int(n) or n < 1 for n in resolution):
+        raise ValueError('resolution must be a pair of positive whole numbers')
+    if resolution[0]*resolution[1] > app.config['JOBS_MAX_GRID_POINTS']:
+        raise ValueError('at most %d grid points' % app.config['JOBS_MAX_GRID_POINTS'])
+
+    principals = np.linspace(principal_range[0], principal_range[1], int(resolution[0]))
+    deposits = np.linspace(deposit_range[0], deposit_range[1], int(resolution[1]))
+    rows = app.config['JOBS_GRID_ROWS_PER_TASK']
+    tasks = [(grid_rows, (principals[i:i+rows], deposits, scenario['int_rate'], scenario['time'], scenario['target']))
+             for i in range(0, len(principals), rows)]
+
+    def finish(blocks):
+        meets_target = np.vstack(blocks)
+        return {'principals': axis_labels(principals).tolist(), 'deposits': axis_labels(deposits).tolist(),
+                'meets_target': meets_target.astype(int).tolist(),
+                'fraction_meeting_target': float(meets_target.mean())}
+
+    return tasks, finish
+
+def check_number(scenario, name, low, high, whole=False):
+    '''Raises ValueError unless scenario[name] is a number (an int if whole) from low to high.'''
+    value = scenario[name]
+    kinds = int if whole else (int, float)
+    if isinstance(value, bool) or not isinstance(value, kinds) or not np.isfinite(value) or not low <= value <= high:
+        raise ValueError('%s must be a %s from %s to %s' % (name, 'whole number' if whole else 'number', low, high))
+
+def check_date(scenario, name):
+    '''Raises ValueError unless scenario[name] is a YYYY-MM-DD date.'''
+    try:
+        np.datetime64(str(scenario[name]), 'D')
+    except ValueError:
+        raise ValueError('%s must be a date such as 2019-10-07' % name)
+
+def monte_carlo_job(scenario):
+    '''
+    Tasks and finish of a "monte_carlo" job: a simulate-loans scenario
+    (see student_finance.cli) run as run_monte_carlo's chunks, whose
+    aggregates are merged in chunk order so the summary matches the
+    command line's. The scenario gives a principal; statement files
+    are not read on behalf of the API. Raises ValueError for an
+    invalid scenario.
+    '''
+    from student_finance import cli
+    from student_finance.accrual import accrue
+    from student_finance.loans import default_calendar
+    from student_finance.runner import chunk_plan, run_chunk
+    from student_finance.streaming import StreamingAggregate
+
+    if isinstance(scenario, dict) and 'payments' in scenario:
+        raise ValueError('give a principal, statement files cannot be read through the API')
+    for setting in ('tolerance', 'per_trajectory', 'output', 'workers', 'record'):
+        if isinstance(scenario, dict) and scenario.get(setting):
+            raise ValueError('%s is not supported for jobs' % setting)
+    scenario = cli.normalise_scenario(scenario)
+    check_number(scenario, 'sims', 1, app.config['JOBS_MAX_SIMS'], whole=True)
+    check_number(scenario, 'years', 1, app.config['API_MAX_YEARS'], whole=True)
+    check_number(scenario, 'chunk_size', 1, app.config['JOBS_MAX_CHUNK_SIZE'], whole=True)
+    check_number(scenario, 'seed', 0, 2**63 - 1, whole=True)
+    check_number(scenario, 'starting_salary', 0, 1e9)
+    check_number(scenario, 'principal', -1e9, 1e9)
+    check_date(scenario, 'employment_start')
+    if scenario.get('principal_date'):
+        check_date(scenario, 'principal_date')
+    for name in ('stop_at_payoff', 'antithetic'):
+        if not isinstance(scenario[name], bool):
+            raise ValueError('%s must be true or false' % name)
+    for spec in ('salary_model', 'rate_model'):
+        if scenario[spec] is not None and not isinstance(scenario[spec], dict):
+            raise ValueError('%s must be an object with a type' % spec)
+    salary_levels = (scenario['salary_model'] or {}).get('salary_levels', scenario['salary_levels'])
+    check_number({'salary_levels': salary_levels}, 'salary_levels', 1, app.config['JOBS_MAX_SALARY_LEVELS'], whole=True)
+
+    calendar = default_calendar()
+    if scenario.get('principal_date'):
+        principal = accrue(scenario['principal'], str(scenario['principal_date']), scenario['employment_start'], calendar)
+    else:
+        principal = float(scenario['principal'])
+    spans, seeds, settings = chunk_plan(scenario['starting_salary'], scenario['years'], principal,
+                                        scenario['employment_start'], scenario['sims'], seed=scenario['seed'],
+                                        chunk_size=scenario['chunk_size'], salary_levels=salary_levels,
+                                        calendar=calendar, rate_model=cli.rate_model(scenario['rate_model']),
+                                        salary_model=cli.salary_model(scenario['salary_model']),
+                                        stop_at_payoff=scenario['stop_at_payoff'], antithetic=scenario['antithetic'])
+    tasks = [(run_chunk, (seed_seq, size, settings)) for (offset, size), seed_seq in zip(spans, seeds)]
+
+    def finish(chunks):
+        aggregate = StreamingAggregate()
+        cohorts = None
+        for chunk_aggregate, chunk_cohorts, _, _ in chunks:
+            aggregate.merge(chunk_aggregate)
+            if chunk_cohorts is not None:
+                if cohorts is None:
+                    cohorts = chunk_cohorts
+                else:
+                    for name, cohort in chunk_cohorts.items():
+                        cohorts[name].merge(cohort)
+        result = {'principal': principal, 'sims': scenario['sims'], **aggregate.summary()}
+        if cohorts is not None:
+            result['cohorts'] = {name: cohort.summary() for name, cohort in cohorts.items()}
+        return json.loads(json.dumps(result, default=float)) # numpy scalars to plain JSON
+
+    return tasks, finish
+
+JOB_KINDS = {'grid': grid_job, 'monte_carlo': monte_carlo_job}
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    '''
+    JSON body {"kind": "grid" | "monte_carlo", "scenario": {...}}.
+    Queues the job and responds 202 with its status and a Location to
+    poll, or 200 with the result when the same scenario has already
+    been run.
+    '''
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or payload.get('kind') not in JOB_KINDS:
+        return jsonify({'errors': ['expected {"kind": %s, "scenario": {...}}' % ' | '.join(map(json.dumps, JOB_KINDS))]}), 400
+    scenario = payload.get('scenario')
+    try:
+        tasks, finish = JOB_KINDS[payload['kind']](scenario)
+    except (ValueError, TypeError, KeyError) as e: # KeyError: a date before the rate table
+        return jsonify({'errors': [str(e.args[0]) if e.args else str(e)]}), 400
+    job = job_queue.submit(payload['kind'], scenario, tasks, finish)
+    status = job.status()
+    response = jsonify(status)
+    response.headers['Location'] = url_for('job_status', job_id=job.id)
+    return response, 200 if status['state'] == 'done' else 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.status())
+
+@app.route('/jobs/stats')
+def job_stats():
+    return jsonify(job_queue.stats())
+
+def time_requests(app):
+    '''Times every request as a "request <endpoint>" profiling stage.'''
+    @app.before_request
+    def start_request_timer():
+        g.profile_stage = profiling.stage('request %s' % request.endpoint)
+        g.profile_stage.__enter__()
 
-    payment_matrix = pd.DataFrame(index = range(0,55000,5000),columns=range(0,1050,50))
-    for i in payment_matrix.index:
-        for j in payment_matrix.columns:
-            content['principal'] = int(i)
-            content['mon_amount'] = int(j)
-            payment_matrix.loc[i,j] = simulate(content)
-    binary = payment_matrix.applymap(lambda x: 0 if x < content['target'] else 1)
-    
-    fig = plt.figure()
-    # Define colors
-    colors = ((223/255, 221/255, 221/255), (0.298, 0.686, 0.314))
-    cmap = LinearSegmentedColormap.from_list('Custom', colors, len(colors))
-    ax = sns.heatmap(binary,linewidths=0.3, linecolor='#041A32', cmap=cmap)
-    ax.set_xlabel("Monthly deposit", color="white")
-    ax.set_ylabel("Principal", color="white")
-    sns.despine()
-    ax.spines['bottom'].set_linewidth(1)
-    ax.spines['bottom'].set_color('#041A32')
-    ax.spines['left'].set_linewidth(1)
-    ax.spines['left'].set_color('#041A32')
-
-    ax.tick_params(axis='y', which='both', colors='white', width=5)
-    ax.tick_params(axis='x', which='both', colors='white', width=5)
-
-    # Set the colorbar labels
-    colorbar = ax.collections[0].colorbar
-    colorbar.set_ticks([0.25,0.75])
-    colorbar.set_ticklabels(['Miss target', 'Meet target'])
-    colorbar.ax.tick_params(colors="white")
-    plt.ylim(11,0)
-    plt.tight_layout()
-    fig.patch.set_facecolor('#041A32')
-    # Convert plot to img 
-    # plt.savefig(output, format='png',dpi=100, facecolor='#041A32', bbox_inches='tight')
-    pngImage = BytesIO()
-    FigureCanvas(fig).print_png(pngImage)
-
-    # Encode PNG to base64 string
-    pngImageB64String = "data:image/png;base64,"
-    pngImageB64String += base64.b64encode(pngImage.getvalue()).decode('ascii')
-    pngImage.seek(0)
-    
-    
-    return render_template('prediction.html',results=results, image=pngImageB64String)
+    @app.teardown_request
+    def stop_request_timer(exc):
+        if 'profile_stage' in g:
+            g.profile_stage.__exit__(None, None, None)
 
 if __name__=='__main__':
-    app.run(debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Investment calculator web app')
+    parser.add_argument('--profile', action='store_true',
+                        help='time requests and the grid, render and batch stages, printing a table on exit')
+    parser.add_argument('--profile-output', help='also write a cProfile dump of the server to this path')
+    args = parser.parse_args()
+    if args.profile or args.profile_output:
+        ## single threaded and without the reloader, so cProfile and the
+        ## stage timers see every request in this process
+        time_requests(app)
+        with profiling.profile_run(args.profile_output):
+            try:
+                app.run(debug=True, threaded=False, use_reloader=False)
+            finally:
+                print(profiling.table())
+    else:
+        app.run(debug=True)
\ No newline at end of file
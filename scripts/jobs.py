@@ -0,0 +1,181 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import json
+import os
+import threading
+import time
+
+from lru_cache import LRUCache, cache_key
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class Job:
+    '''
+    One submitted scenario, run as independent tasks whose results
+    are combined by finish(results) once all have completed. Progress
+    is the number of tasks done.
+    '''
+
+    def __init__(self, job_id, kind, tasks, finish):
+        self.id = job_id
+        self.kind = kind
+        self.tasks = tasks
+        self.finish = finish
+        self.results = [None]*len(tasks)
+        self.done = 0
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+
+    def status(self):
+        status = {'id': self.id, 'kind': self.kind, 'state': self.state,
+                  'progress': {'done': self.done, 'total': len(self.tasks)},
+                  'submitted': self.submitted, 'finished': self.finished}
+        if self.state == DONE:
+            status['result'] = self.result
+        elif self.state == FAILED:
+            status['error'] = self.error
+        return status
+
+
+class JobQueue:
+    '''
+    Runs jobs in the background on a process pool, or on threads in
+    this process with in_process=True (a stand-in for environments
+    without worker processes). Job ids are the hash of the job kind
+    and scenario, so resubmitting a scenario returns the existing
+    job, finished or not, without recomputing it. Queued and running
+    jobs are kept until they finish; finished jobs are then kept in a
+    bounded LRU cache, and a job evicted from it is recomputed on its
+    next submission, as is a failed job. A process pool broken by a
+    worker dying (e.g. killed for running out of memory) is replaced
+    on the next submission. Safe to share between request threads.
+    '''
+
+    def __init__(self, max_workers=None, in_process=False, maxsize=256):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.in_process = in_process
+        self.active = {} # job id: job still queued or running
+        self.finished = LRUCache(maxsize=maxsize)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        '''Pool created on first use, so importing the app starts no processes.'''
+        with self._lock:
+            if self._executor is None:
+                pool = ThreadPoolExecutor if self.in_process else ProcessPoolExecutor
+                self._executor = pool(max_workers=self.max_workers)
+            return self._executor
+
+    def submit(self, kind, scenario, tasks, finish):
+        '''
+        Queues a job for scenario unless the same one was already
+        submitted. tasks is a list of (function, args) run on the pool
+        (picklable, for the process pool); finish(results) combines
+        their results, in task order, in this process. Returns the Job.
+        '''
+        job_id = job_key(kind, scenario)
+        with self._lock:
+            job = self.active.get(job_id) or self.finished.get(job_id)
+            if job is not None and job.state != FAILED:
+                return job
+            job = Job(job_id, kind, tasks, finish)
+            self.active[job_id] = job
+        try:
+            for index, (function, args) in enumerate(tasks):
+                executor = self.executor
+                try:
+                    future = executor.submit(function, *args)
+                except BrokenProcessPool:
+                    self._replace(executor)
+                    executor = self.executor
+                    future = executor.submit(function, *args)
+                future.add_done_callback(lambda future, index=index, executor=executor:
+                                         self._task_done(job, index, future, executor))
+        except Exception as e: # e.g. a pool that cannot be started
+            self._fail(job, repr(e))
+            return job
+        with self._lock:
+            if job.state == QUEUED:
+                job.state = RUNNING
+        if not tasks:
+            self._complete(job)
+        return job
+
+    def _replace(self, executor):
+        '''Drops a broken pool, so the next task starts a new one.'''
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _task_done(self, job, index, future, executor):
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._replace(executor)
+        with self._lock:
+            if job.state == FAILED:
+                return
+            if error is None:
+                job.results[index] = future.result()
+                job.done += 1
+            complete = error is None and job.done == len(job.tasks)
+        if error is not None:
+            self._fail(job, repr(error))
+        elif complete:
+            self._complete(job)
+
+    def _complete(self, job):
+        try:
+            result = job.finish(job.results)
+        except Exception as e: # reported through the job's status
+            self._fail(job, repr(e))
+            return
+        job.result, job.state = result, DONE
+        self._retire(job)
+
+    def _fail(self, job, error):
+        with self._lock:
+            if job.state == FAILED:
+                return
+            job.state, job.error = FAILED, error
+        self._retire(job)
+
+    def _retire(self, job):
+        '''Moves a finished or failed job from the active jobs to the LRU.'''
+        job.results = None # the partial results are no longer needed
+        job.finished = time.time()
+        with self._lock:
+            self.finished.put(job.id, job)
+            if self.active.get(job.id) is job:
+                del self.active[job.id]
+
+    def get(self, job_id):
+        '''Job for job_id, or None if it was never submitted or has been evicted.'''
+        with self._lock:
+            job = self.active.get(job_id)
+        return job if job is not None else self.finished.peek(job_id)
+
+    def stats(self):
+        stats = self.finished.stats()
+        with self._lock:
+            stats['active'] = len(self.active)
+        stats['in_process'] = self.in_process
+        stats['max_workers'] = self.max_workers
+        return stats
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def job_key(kind, scenario):
+    '''Id of a job: the cache_key of its kind and canonical scenario.'''
+    return cache_key(kind=kind, scenario=json.dumps(scenario, sort_keys=True, default=str))
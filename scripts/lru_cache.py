@@ -0,0 +1,73 @@
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+
+def cache_key(**inputs):
+    '''
+    Normalised key for a set of inputs: numbers are compared
+    by value (so "7" and 7.0 share an entry) and argument order is
+    irrelevant.
+    '''
+    normalised = {}
+    for name, value in inputs.items():
+        try:
+            normalised[name] = float(value)
+        except (TypeError, ValueError):
+            normalised[name] = str(value).strip()
+    payload = json.dumps(normalised, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class LRUCache:
+    '''
+    Bounded least-recently-used cache, e.g. of rendered heatmaps (the
+    PNG bytes and computed grid) or finished jobs. Safe to share
+    between request threads.
+    '''
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        '''Cached entry for key, or None, counting a hit or miss.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def peek(self, key):
+        '''Cached entry for key without touching recency or counters.'''
+        with self._lock:
+            return self._entries.get(key)
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_create(self, key, create):
+        '''Cached entry for key, building and storing it with create() on a miss.'''
+        entry = self.get(key)
+        if entry is None:
+            entry = create()
+            self.put(key, entry)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
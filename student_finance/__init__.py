@@ -0,0 +1,17 @@
+'''
+Student finance repayment simulation.
+
+Importable simulation code used by the payoff simulation notebooks.
+The names below are imported on first use, so importing the package
+(e.g. for the simulate-loans command line) does not load numpy.
+'''
+
+LAZY = {"simulate_lifetime_earnings_batch": "student_finance.engine",
+        "RepaymentCalendar": "student_finance.repayment_calendar"}
+
+
+def __getattr__(name):
+    if name not in LAZY:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    import importlib
+    return getattr(importlib.import_module(LAZY[name]), name)
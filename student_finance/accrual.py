@@ -0,0 +1,74 @@
+'''
+Closed-form interest accrual on the loan before repayment starts.
+
+Rather than stepping one day at a time, the balance at any date is the
+sum of each instalment grown by the product of the daily compounding
+factors between its payment date and that date, which the repayment
+calendar evaluates piecewise over its rate segments.
+'''
+
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from student_finance import profiling
+from student_finance.repayment_calendar import as_day
+
+
+@profiling.timed("principal accrual")
+def accrued_balance(dates, amounts, end_date, calendar):
+    '''
+    Loan value at end_date given instalments of amounts paid on
+    dates. As in graduate_amount, interest compounds on every day up
+    to and including end_date, and an instalment starts accruing the
+    day after it is paid. Instalments after end_date are ignored.
+    '''
+    days = np.asarray(dates, dtype='datetime64[D]')
+    amounts = np.asarray(amounts, dtype=np.float64)
+    end = as_day(end_date)
+    paid = days <= end
+    if not paid.any():
+        return 0.0
+    growth = calendar.compound_factor(end + 1)/calendar.compound_factor(days[paid] + 1)
+    return float(np.sum(amounts[paid]*growth))
+
+
+@profiling.timed("principal accrual")
+def accrue(principal, principal_date, end_date, calendar):
+    '''
+    Grows a known balance from principal_date to end_date, both
+    days inclusive, as loanAtEmployment does.
+    '''
+    return principal*calendar.growth(principal_date, as_day(end_date) + 1)
+
+
+@profiling.timed("statement parsing")
+def read_instalments(payments_file, date_header="PaymentDate", amount_header="Gross"):
+    '''
+    Reads instalment dates and amounts from a statement csv such
+    as data/trimmed_data.csv.
+    '''
+    import pandas as pd # only needed when reading a statement
+
+    paymentsData = pd.read_csv(payments_file, parse_dates=[date_header])
+    dates = paymentsData[date_header].values.astype('datetime64[D]')
+    return dates, paymentsData[amount_header].values.astype(np.float64)
+
+
+def principal_at(payments_file, end_date, calendar, date_header="PaymentDate"):
+    '''
+    Loan value at end_date for the instalments in payments_file.
+
+    Memoised on the statement file (path and modification time), the
+    end date and the calendar's rate table, so repeated calls within a
+    run cost a dictionary lookup.
+    '''
+    path = os.path.abspath(payments_file)
+    return _principal_at(path, os.path.getmtime(path), str(as_day(end_date)), calendar, date_header)
+
+
+@lru_cache(maxsize=128)
+def _principal_at(path, mtime, end_date, calendar, date_header):
+    dates, amounts = read_instalments(path, date_header=date_header)
+    return accrued_balance(dates, amounts, end_date, calendar)
@@ -0,0 +1,202 @@
+'''
+simulate-loans: runs a Monte Carlo repayment scenario headless.
+
+    simulate-loans scenario.yaml [--sims N] [--seed N] [--workers N] [--output DIR] [--profile]
+
+The scenario is a YAML (needs PyYAML) or JSON file:
+
+    payments: trimmed_data.csv     # statement csv, relative to the scenario file
+                                   # or the data directory; or instead
+    principal: 46283.87            # loan value, on principal_date if given
+    employment_start: 2019-10-07
+    years: 30
+    starting_salary: 29000
+    sims: 100000
+    seed: 101
+    workers: 4                     # default: every CPU
+    salary_model: {type: lognormal, gender: men, education: HE}
+    rate_model: {type: ar1, since: 1988}
+    stop_at_payoff: true
+    output: results/my_run
+    record: {sample: 1000, every: 3}
+
+With a tolerance the run is adaptive (runner.run_adaptive): batches of
+batch_size trajectories are drawn until the confidence intervals of
+the mean end balance, P(paid off) and mean total repaid are narrower
+than the tolerance (relative to the estimate with relative: true), and
+sims becomes the upper limit. antithetic: true pairs the salary
+shocks of the default band_shock model.
+
+record keeps balance and salary trajectories for plotting, taking
+the options of trajectories.TrajectoryRecorder (sample, every, path,
+band_accuracy, ...); the output then holds the sampled paths and
+per-month percentile bands of every trajectory.
+
+salary_model types are band_shock (the notebook's model, the
+default, taking only salary_levels), median, lognormal and cohorts;
+rate_model types are bootstrap and ar1 (default: flat 5.5%). The run
+is written with results_store.save_results. numpy, pandas and the
+simulation modules are only imported once the arguments are parsed.
+
+The rate tables, median earnings curves and the data directory that
+payments falls back to are those shipped with the package;
+STUDENT_FINANCE_DATA names another data directory.
+'''
+
+import argparse
+import json
+import os
+import sys
+
+DEFAULTS = {"date_header": "PaymentDate", "years": 30, "starting_salary": 29000, "sims": 100000, "seed": 101,
+            "workers": None, "chunk_size": 10000, "salary_levels": 6, "salary_model": None, "rate_model": None,
+            "stop_at_payoff": False, "per_trajectory": False, "output": None,
+            "tolerance": None, "relative": False, "confidence": 0.95, "batch_size": 50000, "antithetic": False,
+            "record": None}
+
+
+def read_scenario(path):
+    '''Scenario dict from a .yaml/.yml or .json file, with defaults filled in.'''
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml # optional dependency, only for YAML scenarios
+            scenario = yaml.safe_load(f)
+        else:
+            scenario = json.load(f)
+    return normalise_scenario(scenario, os.path.dirname(os.path.abspath(path)))
+
+
+def normalise_scenario(scenario, base_dir="."):
+    '''
+    Checks a scenario dict and fills in the defaults. A payments path
+    is resolved against base_dir, then the data directory.
+    '''
+    if not isinstance(scenario, dict):
+        raise ValueError("a scenario is a mapping of settings")
+    unknown = set(scenario) - set(DEFAULTS) - {"payments", "principal", "principal_date", "employment_start"}
+    if unknown:
+        raise ValueError("unknown scenario settings: %s" % ", ".join(sorted(unknown)))
+    if "employment_start" not in scenario:
+        raise ValueError("scenario needs an employment_start")
+    if ("payments" in scenario) == ("principal" in scenario):
+        raise ValueError("scenario needs exactly one of payments or principal")
+    scenario = dict(DEFAULTS, **scenario)
+    scenario["employment_start"] = str(scenario["employment_start"]) # YAML reads unquoted dates as dates
+    if "payments" in scenario:
+        payments = os.path.join(base_dir, scenario["payments"])
+        if not os.path.exists(payments):
+            from student_finance.rates import DATA_DIR
+            payments = os.path.join(DATA_DIR, scenario["payments"])
+        scenario["payments"] = os.path.abspath(payments)
+    return scenario
+
+
+def build_model(spec, models, name):
+    '''Instantiates {"type": ..., **kwargs} from a dict of model factories.'''
+    if spec is None:
+        return None
+    spec = dict(spec)
+    kind = spec.pop("type", None)
+    if kind not in models:
+        raise ValueError("unknown %s type %r, expected one of %s" % (name, kind, ", ".join(sorted(models))))
+    return models[kind](**spec)
+
+
+def band_shock(salary_levels=6, **unknown):
+    '''
+    The band_shock salary_model: the runner's built-in band increases
+    (salary_model None), whose only setting, salary_levels, run_scenario
+    reads from the spec.
+    '''
+    if unknown:
+        raise ValueError("band_shock salary_model only takes salary_levels, not %s" % ", ".join(sorted(unknown)))
+    return None
+
+
+def salary_model(spec):
+    from student_finance import salary_models
+    return build_model(spec, {"band_shock": band_shock,
+                              "median": salary_models.MedianSalary,
+                              "lognormal": salary_models.LognormalSalary,
+                              "cohorts": salary_models.CohortSalaries.median_cohorts}, "salary_model")
+
+
+def rate_model(spec):
+    from student_finance import rate_paths
+    return build_model(spec, {"bootstrap": rate_paths.BootstrapRates, "ar1": rate_paths.AR1Rates}, "rate_model")
+
+
+def run_scenario(scenario, progress=None):
+    '''Runs a scenario dict from read_scenario. Returns (results, principal).'''
+    from student_finance.accrual import accrue, principal_at
+    from student_finance.rates import repayment_calendar
+    from student_finance.runner import run_adaptive, run_monte_carlo
+
+    calendar = repayment_calendar()
+    if "payments" in scenario:
+        principal = principal_at(scenario["payments"], scenario["employment_start"], calendar,
+                                 date_header=scenario["date_header"])
+    elif scenario.get("principal_date"):
+        principal = accrue(scenario["principal"], str(scenario["principal_date"]), scenario["employment_start"], calendar)
+    else:
+        principal = float(scenario["principal"])
+    salary_levels = (scenario["salary_model"] or {}).get("salary_levels", scenario["salary_levels"])
+    options = {"seed": scenario["seed"], "chunk_size": scenario["chunk_size"], "workers": scenario["workers"],
+               "salary_levels": salary_levels, "calendar": calendar, "rate_model": rate_model(scenario["rate_model"]),
+               "salary_model": salary_model(scenario["salary_model"]), "stop_at_payoff": scenario["stop_at_payoff"],
+               "antithetic": scenario["antithetic"], "record": scenario["record"]}
+    if scenario["tolerance"] is not None:
+        report = None if progress is None else lambda sims, estimates: progress(sims, scenario["sims"])
+        results = run_adaptive(scenario["starting_salary"], scenario["years"], principal, scenario["employment_start"],
+                               scenario["tolerance"], relative=scenario["relative"], confidence=scenario["confidence"],
+                               batch_size=scenario["batch_size"], min_sims=min(2*scenario["batch_size"], scenario["sims"]),
+                               max_sims=scenario["sims"], progress=report, **options)
+    else:
+        results = run_monte_carlo(scenario["starting_salary"], scenario["years"], principal, scenario["employment_start"],
+                                  scenario["sims"], progress=progress, per_trajectory=scenario["per_trajectory"], **options)
+    return results, principal
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="simulate-loans", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", help="YAML or JSON scenario file")
+    parser.add_argument("--sims", type=int, help="override the scenario's number of simulations")
+    parser.add_argument("--seed", type=int, help="override the scenario's seed")
+    parser.add_argument("--workers", type=int, help="override the scenario's number of worker processes")
+    parser.add_argument("--output", help="results directory (default: the scenario's output, if any)")
+    parser.add_argument("--quiet", action="store_true", help="no progress output")
+    parser.add_argument("--profile", action="store_true", help="time the simulation stages and print a table")
+    parser.add_argument("--profile-output", help="also write a cProfile dump of the run to this path")
+    args = parser.parse_args(argv)
+
+    scenario = read_scenario(args.scenario)
+    for name in ("sims", "seed", "workers", "output"):
+        if getattr(args, name) is not None:
+            scenario[name] = getattr(args, name)
+
+    from contextlib import nullcontext
+    from student_finance import profiling
+    from student_finance.runner import print_progress
+
+    profile = args.profile or args.profile_output
+    with (profiling.profile_run(args.profile_output) if profile else nullcontext()):
+        results, principal = run_scenario(scenario, progress=None if args.quiet else print_progress)
+        summary = results["aggregate"].summary()
+        if scenario["output"]:
+            from student_finance.results_store import save_results
+            save_results(scenario["output"], results, parameters=dict(scenario, principal=principal))
+
+    report = {"principal": principal, **summary}
+    if "estimates" in results:
+        report.update(sims_used=results["sims"], converged=results["converged"], estimates=results["estimates"])
+    print(json.dumps(report, indent=2, default=float))
+    if scenario["output"]:
+        print("results written to %s" % scenario["output"])
+    if profile:
+        print(profiling.table())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+'''
+Incremental loan ledger with balance snapshots.
+
+A LoanLedger holds the dated instalments (loan paid out) and
+repayments of one loan. Statements are ingested incrementally: only
+lines appended to a csv since it was last read are parsed. Balances
+are evaluated over the repayment calendar's rate segments and the
+balance at every rate-change boundary is kept as a checkpoint, so a
+point-in-time query replays only the entries since the nearest
+checkpoint, and a new entry only invalidates the checkpoints after it.
+
+As in graduate_amount, interest compounds on every day up to and
+including the query date, and an entry starts accruing the day after
+it is made.
+'''
+
+import csv
+import io
+import os
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import numpy as np
+
+from student_finance.repayment_calendar import as_day
+
+DATE_HEADERS = ("PaymentDate", "Payment Date")
+DATE_FORMATS = ("%d %B %Y", "%d/%m/%Y", "%Y-%m-%d") # trimmed_data.csv, unedited_data.csv, ISO
+REPAYMENT_WORDS = ("repayment", "payment received")
+
+
+def parse_date(text):
+    '''Statement date in any of DATE_FORMATS as a datetime64 day, or None.'''
+    for format in DATE_FORMATS:
+        try:
+            return np.datetime64(datetime.strptime(text.strip(), format).date(), 'D')
+        except ValueError:
+            continue
+    return None
+
+
+def parse_amount(text):
+    '''Statement amount such as "£1,191.30" as a float, or None.'''
+    try:
+        return float(text.replace("£", "").replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+class LoanLedger:
+    '''
+    Instalments (positive) and repayments (negative) of one loan on
+    a RepaymentCalendar, with memoised balances at its rate
+    boundaries.
+    '''
+
+    def __init__(self, calendar):
+        self.calendar = calendar
+        self._days = [] # sorted day numbers of the entries
+        self._amounts = [] # signed amounts, in the same order
+        self._sources = {} # path: {"offset", "tail", "columns", "entries", "partial"} of the statement read so far
+        self._boundaries = calendar.boundaries.astype(np.int64).tolist()
+        self._checkpoints = [0.0] # balance at the start of segment k, before its first day's interest
+
+    def __len__(self):
+        return len(self._days)
+
+    def add(self, date, amount):
+        '''Records an instalment of amount (a repayment if negative) on date.'''
+        day = int(as_day(date).astype(np.int64))
+        segment = self.calendar.segment(as_day(date)) # KeyError before the first rate
+        i = bisect_right(self._days, day)
+        self._days.insert(i, day)
+        self._amounts.insert(i, float(amount))
+        del self._checkpoints[segment+1:] # every later boundary balance includes this entry
+
+    def remove(self, date, amount):
+        '''Removes an entry recorded by add.'''
+        day = int(as_day(date).astype(np.int64))
+        lo, hi = bisect_left(self._days, day), bisect_right(self._days, day)
+        i = lo + self._amounts[lo:hi].index(float(amount)) # ValueError if there is no such entry
+        del self._days[i], self._amounts[i]
+        del self._checkpoints[self.calendar.segment(as_day(date))+1:]
+
+    def add_repayment(self, date, amount):
+        '''Records a repayment of amount on date.'''
+        self.add(date, -abs(amount))
+
+    def extend(self, dates, amounts):
+        '''Records several entries at once.'''
+        for date, amount in zip(dates, amounts):
+            self.add(date, amount)
+
+    def ingest(self, path):
+        '''
+        Reads the statement lines of a trimmed_data.csv or
+        unedited_data.csv style statement that were appended since the
+        last call for the same path, and returns the number of entries
+        added. A statement that changed other than by appending lines
+        is re-read from the start, replacing the entries it gave before.
+        A last line without a newline is read too, and read again
+        (replacing its entry) next time in case it was still being
+        written.
+        '''
+        path = os.path.abspath(path)
+        source = self._sources.get(path)
+        with open(path, "rb") as f:
+            if source is not None:
+                f.seek(source["offset"] - len(source["tail"]))
+                if f.read(len(source["tail"])) != source["tail"]:
+                    for date, amount in source["entries"] + source["partial"]:
+                        self.remove(date, amount)
+                    source = None
+            if source is None:
+                source = {"offset": 0, "tail": b"", "columns": None, "entries": [], "partial": []}
+                f.seek(0)
+            data = f.read()
+        for date, amount in source["partial"]:
+            self.remove(date, amount)
+        replaced, source["partial"] = len(source["partial"]), []
+        complete = data[:data.rfind(b"\n") + 1]
+        lines = complete.decode("utf-8-sig").splitlines()
+        added = 0
+        for row in csv.reader(io.StringIO("\n".join(lines))):
+            added += self._ingest_row(row, source, source["entries"])
+        if lines:
+            source["offset"] += len(complete)
+            source["tail"] = complete.splitlines(keepends=True)[-1]
+        unterminated = data[len(complete):]
+        if unterminated.strip():
+            text = unterminated.decode("utf-8-sig" if not source["offset"] else "utf-8")
+            for row in csv.reader(io.StringIO(text)):
+                added += self._ingest_row(row, source, source["partial"])
+        self._sources[path] = source
+        return added - replaced
+
+    def _ingest_row(self, row, source, entries):
+        header = [cell.strip() for cell in row]
+        if "Gross" in header and any(name in header for name in DATE_HEADERS):
+            date_col = next(header.index(name) for name in DATE_HEADERS if name in header)
+            description_col = header.index("Description") if "Description" in header else None
+            source["columns"] = (date_col, header.index("Gross"), description_col)
+            return 0
+        if source["columns"] is None:
+            return 0
+        date_col, gross_col, description_col = source["columns"]
+        if len(row) <= max(date_col, gross_col):
+            return 0
+        date, amount = parse_date(row[date_col]), parse_amount(row[gross_col])
+        if date is None or amount is None: # totals, notes and the rate table of unedited_data.csv
+            return 0
+        if description_col is not None and row[description_col].strip().lower().startswith(REPAYMENT_WORDS):
+            amount = -abs(amount)
+        self.add(date, amount)
+        entries.append((date, amount))
+        return 1
+
+    def _checkpoint(self, k):
+        '''Balance at the start of segment k, replayed from the latest valid checkpoint.'''
+        while len(self._checkpoints) <= k:
+            j = len(self._checkpoints) - 1
+            start, end = self._boundaries[j], self._boundaries[j+1]
+            self._checkpoints.append(self._advance(self._checkpoints[j], j, start, end))
+        return self._checkpoints[k]
+
+    def _advance(self, balance, segment, start, end):
+        '''
+        Balance at the start of day end from the balance at the start
+        of day start, both within segment: every day compounds and the
+        entries of each day are added after its interest.
+        '''
+        g = self.calendar.daily_growth[segment]
+        lo, hi = bisect_left(self._days, start), bisect_left(self._days, end)
+        days = np.asarray(self._days[lo:hi], dtype=np.int64)
+        amounts = np.asarray(self._amounts[lo:hi])
+        return float(balance*g**(end - start) + np.sum(amounts*g**(end - 1 - days)))
+
+    def balance_at(self, date):
+        '''Loan value at the end of date.'''
+        day = int(as_day(date).astype(np.int64))
+        if not self._days or day < self._days[0]:
+            return 0.0
+        segment = self.calendar.segment(as_day(date))
+        return self._advance(self._checkpoint(segment), segment, self._boundaries[segment], day + 1)
+
+    def balances_at(self, dates):
+        '''balance_at for each of dates.'''
+        return np.array([self.balance_at(date) for date in np.asarray(dates, dtype='datetime64[D]')])
+
+    def snapshots(self):
+        '''
+        (boundary dates, balances) of the checkpoints computed so far:
+        the balance at the start of each rate segment.
+        '''
+        return self.calendar.boundaries[:len(self._checkpoints)], np.array(self._checkpoints)
+
+    @property
+    def entries(self):
+        '''(dates, amounts) of every entry, in date order.'''
+        return np.array(self._days, dtype='datetime64[D]'), np.array(self._amounts)
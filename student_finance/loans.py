@@ -0,0 +1,128 @@
+'''
+The payoff simulation notebook's loan functions, importable.
+
+readPayments, calc_student_finance_PM, find_interest_rate,
+graduate_amount, loanAtEmployment and simulate_lifetime_earnings keep
+the names and arguments of notebooks/payoffSimulation_blog_style.py,
+but take the statement location and the repayment calendar as
+arguments instead of reading the notebook's globals and working
+directory. pandas is only imported by the functions that need it.
+'''
+
+import os
+from datetime import timedelta
+from functools import lru_cache
+
+from student_finance.accrual import accrue, accrued_balance
+from student_finance.engine import REPAYMENT_RATE, THRESHOLD_PM
+from student_finance.rates import DATA_DIR
+
+
+@lru_cache(maxsize=None)
+def default_calendar():
+    '''RepaymentCalendar of the vendored Plan 2 rate table, built once.'''
+    from student_finance.rates import repayment_calendar
+    return repayment_calendar()
+
+
+def readPayments(file_name, date_header="PaymentDate", data_dir=DATA_DIR):
+    '''
+    Reads in student finance statement as a pandas dataframe.
+    file_name is a path, or the name of a file in data_dir
+    (the repository's data directory by default).
+    '''
+    import pandas as pd
+
+    dataLoc = file_name if os.path.exists(file_name) else os.path.join(data_dir, file_name)
+    return pd.read_csv(dataLoc, index_col=date_header, parse_dates=True)
+
+
+def calc_student_finance_PM(grossSalaryPA):
+    '''
+    Calculates student finance payments per month deducted
+    from gross salary based on thresholds published by
+    Student Finance England.
+    '''
+    grossSalaryPM = grossSalaryPA/12
+    if grossSalaryPM > THRESHOLD_PM:
+        return REPAYMENT_RATE*(grossSalaryPM-THRESHOLD_PM)
+    return 0
+
+
+def find_interest_rate(paymentDate, calendar=None):
+    '''Interest rate of the academic year paymentDate falls in.'''
+    return (calendar or default_calendar()).rate_at(paymentDate)
+
+
+def graduate_amount(simEnd, employmentStart, myPayments, calendar=None):
+    '''
+    Total student debt owed at employment (simEnd="employment"), at
+    the end of the graduation academic year (simEnd="yearEnd") or at
+    the final instalment (any other simEnd), for the instalments in
+    the myPayments dataframe from readPayments.
+    '''
+    import pandas as pd
+
+    if myPayments is None:
+        raise ValueError("graduate_amount needs the statement dataframe, see readPayments")
+    if simEnd == "yearEnd":
+        endDate = pd.Timestamp("%d-08-31" % myPayments.index.max().year) # assumes the final payment is in the graduation year
+    elif simEnd == "employment":
+        endDate = pd.Timestamp(employmentStart)
+    else:
+        endDate = myPayments.index.max()
+    return accrued_balance(myPayments.index.values, myPayments["Gross"].values, endDate, calendar or default_calendar())
+
+
+def loanAtEmployment(principal, principal_date, employment_start, calendar=None):
+    '''When payment data is absent, grows the last statement amount from its date to employment start.'''
+    return accrue(principal, principal_date, employment_start, calendar or default_calendar())
+
+
+def simulate_lifetime_earnings(grossSalaryPA, N, principal, employment_start, method="monte carlo",
+                               increases=None, median=None, interest_rate=0.055):
+    '''
+    The original day-by-day simulator of one salary trajectory,
+    kept to check the batched engine against. increases is indexed
+    by salary band (1, 2, ...) for method="monte carlo"; median is
+    indexed by year of the repayment period for method="median".
+    Returns (loan value after each payment, salary at each payment,
+    total paid).
+    '''
+    import pandas as pd
+    from pandas.tseries.offsets import BMonthEnd
+
+    if method == "monte carlo" and increases is None:
+        raise ValueError("supply monte carlo simulated salary increases")
+    if method == "median" and median is None:
+        raise ValueError("supply median earnings by year")
+
+    salary = [grossSalaryPA]
+    payments_towards = 0
+    today = pd.Timestamp(employment_start)
+    start = today
+    edate = today + timedelta(days=N*365) # N years of payments
+    delta = timedelta(days=1)
+    offset = BMonthEnd() # date each month that tax is paid
+
+    cumulativeTotal = principal
+    cumulativeList = [cumulativeTotal]
+
+    ## interest compounds each day, payment made on last working day of the month
+    while today <= edate:
+        elapsed = (today - start).days
+        if method == "monte carlo" and elapsed > 0 and (elapsed/365)%5 == 0:
+            grossSalaryPA *= increases[elapsed/365/5]
+        if method == "median" and elapsed%365 == 0 and elapsed/365 in median.index:
+            grossSalaryPA = median[elapsed/365]
+
+        cumulativeTotal *= (1+(interest_rate/365))
+        if today == offset.rollforward(today) and today.month == offset.rollforward(today).month:
+            payment = calc_student_finance_PM(grossSalaryPA)
+            cumulativeTotal -= payment
+            payments_towards += payment
+            cumulativeList.append(cumulativeTotal)
+            salary.append(grossSalaryPA)
+        today += delta
+
+    return cumulativeList, salary, payments_towards
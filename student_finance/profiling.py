@@ -0,0 +1,127 @@
+'''
+Opt-in instrumentation of the simulation pipeline.
+
+The hot paths are wrapped in named stages (principal accrual, salary
+generation, rate paths, monthly stepping, aggregation). While
+profiling is disabled, which is the default, a stage is a shared
+no-op context manager and costs one dictionary lookup. Once enabled
+each stage accumulates its call count and wall time; summary() and
+table() report them and profile_run() can also record a cProfile dump
+(readable by pstats, snakeviz or flameprof for a flamegraph).
+
+Stage times are inclusive, so a stage nested in another is counted in
+both. Worker processes keep their own timers; runner.run_monte_carlo
+sends them back with each chunk and merges them here.
+'''
+
+import cProfile
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+_state = {"enabled": False}
+_stages = {} # name: [calls, seconds]
+_NULL = nullcontext()
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        totals = _stages.setdefault(self.name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+        return False
+
+
+def enable(enabled=True):
+    '''Turns the stage timers on (or off with enabled=False).'''
+    _state["enabled"] = bool(enabled)
+
+
+def disable():
+    enable(False)
+
+
+def is_enabled():
+    return _state["enabled"]
+
+
+def reset():
+    '''Clears the accumulated stage timers.'''
+    _stages.clear()
+
+
+def stage(name):
+    '''Context manager timing the named stage while profiling is enabled.'''
+    return _Stage(name) if _state["enabled"] else _NULL
+
+
+def timed(name):
+    '''Decorator timing every call of a function as the named stage.'''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _state["enabled"]:
+                return function(*args, **kwargs)
+            with _Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    '''Plain dict {stage: (calls, seconds)}, e.g. to send back from a worker.'''
+    return {name: tuple(totals) for name, totals in _stages.items()}
+
+
+def merge(stages):
+    '''Adds the stage timers of a snapshot taken elsewhere.'''
+    for name, (calls, seconds) in (stages or {}).items():
+        totals = _stages.setdefault(name, [0, 0.0])
+        totals[0] += calls
+        totals[1] += seconds
+
+
+def summary():
+    '''One dict per stage, slowest first: stage, calls, seconds, mean (seconds per call).'''
+    rows = [{"stage": name, "calls": calls, "seconds": seconds, "mean": seconds/calls if calls else 0.0}
+            for name, (calls, seconds) in _stages.items()]
+    return sorted(rows, key=lambda row: row["seconds"], reverse=True)
+
+
+def table():
+    '''The summary as a fixed-width text table.'''
+    lines = ["%-24s %10s %12s %12s" % ("stage", "calls", "total (s)", "mean (ms)")]
+    for row in summary():
+        lines.append("%-24s %10d %12.4f %12.4f" % (row["stage"], row["calls"], row["seconds"], 1000*row["mean"]))
+    return "\n".join(lines)
+
+
+@contextmanager
+def profile_run(output=None):
+    '''
+    Enables the stage timers for the duration of the with block and,
+    with an output path, records it with cProfile and dumps the
+    stats there on exit. Yields the cProfile.Profile (or None).
+    '''
+    previous = _state["enabled"]
+    enable()
+    profiler = cProfile.Profile() if output else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield profiler
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(output)
+        enable(previous)
@@ -0,0 +1,135 @@
+'''
+Stochastic interest rate paths.
+
+Generators of (sims x years) matrices of annual Plan 2 interest rates
+(RPI + 3%) for the batched simulator: bootstrap resampling of the
+historical March RPI figures in data/rpi_data.csv, or an AR(1) model
+fitted to them. Either can be correlated with the band increase
+salary shocks through a gaussian copula (the runner refuses a
+correlation with any other salary model). Paths are generated in bulk and returned
+as float32 to keep memory flat at 10^6+ simulations.
+'''
+
+import numpy as np
+
+from student_finance import rates as rate_data
+
+SALARY_SHOCK_SCALE = 0.1 # standard deviation of the band increases, see salary_models.monte_carlo_increases
+
+
+def normal_cdf(z):
+    '''
+    Standard normal CDF (Abramowitz and Stegun 7.1.26, absolute
+    error below 1.5e-7), vectorised without scipy.
+    '''
+    z = np.asarray(z, dtype=np.float64)
+    x = np.abs(z)/np.sqrt(2)
+    t = 1/(1 + 0.3275911*x)
+    poly = t*(0.254829592 + t*(-0.284496736 + t*(1.421413741 + t*(-1.453152027 + t*1.061405429))))
+    erf = 1 - poly*np.exp(-x*x)
+    return 0.5*(1 + np.sign(z)*erf)
+
+
+def band_shocks(increases, years, low=.1, high=.4, scale=SALARY_SHOCK_SCALE, rng=None):
+    '''
+    Standardised salary shocks per simulation year, (sims x years).
+
+    increases is the (salary_levels x sims) matrix from
+    salary_models.monte_carlo_increases; year y takes the shock of the
+    band increase applied at year 5*(y//5). Years before the first increase
+    have no salary shock and get independent draws from rng.
+    '''
+    increases = np.asarray(increases, dtype=np.float64)
+    salary_levels, sims = increases.shape
+    means = np.linspace(low, high, salary_levels)[::-1]
+    shocks = ((increases - 1 - means[:, None])/scale).T # (sims x salary_levels)
+    band = np.arange(years)//5
+    out = np.empty((sims, years), dtype=np.float32)
+    shocked = (band >= 1) & (band <= salary_levels)
+    out[:, shocked] = shocks[:, band[shocked] - 1]
+    if not shocked.all():
+        rng = rng if rng is not None else np.random.default_rng()
+        out[:, ~shocked] = rng.standard_normal((sims, int((~shocked).sum())), dtype=np.float32)
+    return out
+
+
+def correlated_normals(rng, sims, years, salary_shocks=None, correlation=0.0):
+    '''Standard normals, correlated with salary_shocks when given.'''
+    z = rng.standard_normal((sims, years), dtype=np.float32)
+    if salary_shocks is not None and correlation:
+        z *= np.float32(np.sqrt(1 - correlation**2))
+        z += np.float32(correlation)*salary_shocks
+    return z
+
+
+def fit_ar1(series):
+    '''Least squares fit of x_t = mean + phi*(x_{t-1} - mean) + sigma*e_t.'''
+    series = np.asarray(series, dtype=np.float64)
+    x, y = series[:-1], series[1:]
+    phi, intercept = np.polyfit(x, y, 1)
+    mean = intercept/(1 - phi)
+    sigma = np.std(y - (intercept + phi*x), ddof=2)
+    return mean, phi, sigma
+
+
+class BootstrapRates:
+    '''
+    Resamples each simulated year's RPI from the historical March RPI
+    figures (those that set Plan 2 rates) and adds the 3% margin.
+    With a correlation, the resampled rank follows the salary shock
+    through a gaussian copula.
+    '''
+
+    def __init__(self, history=None, since=None, margin=rate_data.RPI_MARGIN, correlation=0.0):
+        if history is None:
+            years, history = rate_data.march_rpi()
+            if since is not None:
+                history = history[years >= float(since)]
+        self.history = np.sort(np.asarray(history, dtype=np.float64))
+        if not len(self.history):
+            raise ValueError("no RPI history to resample")
+        self.margin = float(margin)
+        self.correlation = float(correlation)
+
+    def __call__(self, rng, sims, years, salary_shocks=None):
+        if self.correlation and salary_shocks is not None:
+            u = normal_cdf(correlated_normals(rng, sims, years, salary_shocks, self.correlation))
+            index = np.minimum((u*len(self.history)).astype(np.int64), len(self.history) - 1)
+        else:
+            index = rng.integers(0, len(self.history), size=(sims, years))
+        return (self.history[index] + self.margin).astype(np.float32)
+
+
+class AR1Rates:
+    '''
+    AR(1) model of annual RPI, fitted to the historical March RPI
+    unless mean, phi and sigma are given, started from the latest
+    observation; the 3% margin is added to every simulated year.
+    '''
+
+    def __init__(self, mean=None, phi=None, sigma=None, start=None, since=None,
+                 margin=rate_data.RPI_MARGIN, correlation=0.0):
+        if None in (mean, phi, sigma, start):
+            years, history = rate_data.march_rpi()
+            if since is not None:
+                history = history[years >= float(since)]
+            if len(history) < 4:
+                raise ValueError("fitting the AR(1) model needs at least 4 years of RPI history")
+            fitted = fit_ar1(history)
+            mean = fitted[0] if mean is None else mean
+            phi = fitted[1] if phi is None else phi
+            sigma = fitted[2] if sigma is None else sigma
+            start = history[-1] if start is None else start
+        self.mean, self.phi, self.sigma, self.start = float(mean), float(phi), float(sigma), float(start)
+        self.margin = float(margin)
+        self.correlation = float(correlation)
+
+    def __call__(self, rng, sims, years, salary_shocks=None):
+        z = correlated_normals(rng, sims, years, salary_shocks, self.correlation)
+        paths = np.empty((sims, years), dtype=np.float32)
+        rpi = np.full(sims, self.start, dtype=np.float32)
+        for year in range(years):
+            rpi = self.mean + self.phi*(rpi - self.mean) + self.sigma*z[:, year]
+            paths[:, year] = rpi
+        paths += np.float32(self.margin)
+        return paths
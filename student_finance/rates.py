@@ -0,0 +1,173 @@
+'''
+Offline interest rate and RPI data.
+
+Replaces the live scrape of the gov.uk Plan 2 interest page with a
+vendored rate table (data/plan2_interest_rates.csv), the Plan 2
+interest thresholds (data/plan2_thresholds.csv) and the ONS RPI
+series in data/rpi_data.csv. The sources are parsed once and stored as
+a compact .npz cache keyed by a hash of the source files, so later
+loads take milliseconds and never touch the network.
+
+DATA_DIR, the data directory of every module, is the repository's
+data/ or, once installed, the copy shipped inside the package; the
+STUDENT_FINANCE_DATA environment variable points it elsewhere.
+'''
+
+import csv
+import hashlib
+import os
+
+import numpy as np
+
+from student_finance.repayment_calendar import RepaymentCalendar
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+## a non-editable install carries the data as package data (student_finance/data),
+## a checkout has it next to the package; STUDENT_FINANCE_DATA overrides both
+INSTALLED_DATA_DIR = os.path.join(PACKAGE_DIR, "data")
+DATA_DIR = os.environ.get("STUDENT_FINANCE_DATA") or (
+    INSTALLED_DATA_DIR if os.path.isdir(INSTALLED_DATA_DIR) else os.path.join(PACKAGE_DIR, "..", "data"))
+RPI_FILE = "rpi_data.csv"
+PLAN2_FILE = "plan2_interest_rates.csv"
+THRESHOLDS_FILE = "plan2_thresholds.csv"
+CACHE_DIR = ".cache"
+RPI_MARGIN = 0.03 # Plan 2 maximum rate is RPI + 3%
+RATE_SET_MONTH = 3 # March RPI sets the rate for the academic year starting that September
+
+MONTHS = {name: i for i, name in enumerate(
+    ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"], start=1)}
+
+
+def read_rpi(path):
+    '''
+    Parses an ONS time series csv (RPI 12 month % change, CZBH).
+    Skips the metadata header and returns a dict of annual, quarterly
+    and monthly periods and values, rates as fractions.
+    '''
+    annual, quarterly, monthly = [], [], []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0][:4].isdigit():
+                continue # header lines such as "Title", "CDID", "Release date"
+            period, value = row[0].split(), float(row[1])/100
+            if len(period) == 1:
+                annual.append((int(period[0]), value))
+            elif period[1].startswith("Q"):
+                quarterly.append((int(period[0]), int(period[1][1]), value))
+            else:
+                monthly.append(("%s-%02d" % (period[0], MONTHS[period[1]]), value))
+    return {"annual_year": np.array([y for y, v in annual], dtype=np.int64),
+            "annual": np.array([v for y, v in annual]),
+            "quarter_year": np.array([y for y, q, v in quarterly], dtype=np.int64),
+            "quarter": np.array([q for y, q, v in quarterly], dtype=np.int64),
+            "quarterly": np.array([v for y, q, v in quarterly]),
+            "month": np.array([m for m, v in monthly], dtype="datetime64[M]"),
+            "monthly": np.array([v for m, v in monthly])}
+
+
+def read_plan2_table(path):
+    '''Reads the vendored Plan 2 rate table: start, end, rate (%).'''
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    return {"plan2_start": np.array([row["start"] for row in rows], dtype="datetime64[D]"),
+            "plan2_end": np.array([row["end"] for row in rows], dtype="datetime64[D]"),
+            "plan2_rate": np.array([float(row["rate"])/100 for row in rows])}
+
+
+def read_thresholds(path):
+    '''Reads the Plan 2 interest thresholds: start, lower, upper income.'''
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    return {"threshold_start": np.array([row["start"] for row in rows], dtype="datetime64[D]"),
+            "threshold_lower": np.array([float(row["lower"]) for row in rows]),
+            "threshold_upper": np.array([float(row["upper"]) for row in rows])}
+
+
+def _source_hash(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def load_rates(data_dir=None, cache_dir=None):
+    '''
+    All rate data as a dict of numpy arrays, from the .npz cache
+    when the source files are unchanged, else parsed and cached.
+    '''
+    data_dir = data_dir or DATA_DIR
+    cache_dir = cache_dir or os.path.join(data_dir, CACHE_DIR)
+    sources = [os.path.join(data_dir, name) for name in (RPI_FILE, PLAN2_FILE, THRESHOLDS_FILE)]
+    cache_file = os.path.join(cache_dir, "rates-%s.npz" % _source_hash(sources))
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            return {name: cached[name] for name in cached.files}
+
+    rates = read_rpi(sources[0])
+    rates.update(read_plan2_table(sources[1]))
+    rates.update(read_thresholds(sources[2]))
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = cache_file + ".%d.tmp" % os.getpid()
+        with open(tmp_file, "wb") as f:
+            np.savez(f, **rates)
+        os.replace(tmp_file, cache_file) # atomic, so concurrent workers never read half a cache
+    except OSError:
+        pass # read-only data directory, parse again next time
+    return rates
+
+
+def historic_interest(rates=None):
+    '''
+    The vendored Plan 2 table in the notebook's historicInterest
+    format: {start year: {"start": date, "end": date, "rate": fraction}}.
+    '''
+    rates = rates if rates is not None else load_rates()
+    historicInterest = {}
+    for start, end, rate in zip(rates["plan2_start"], rates["plan2_end"], rates["plan2_rate"]):
+        start, end = start.astype(object), end.astype(object) # datetime.date
+        historicInterest[str(start.year)] = {"start": start, "end": end, "rate": float(rate)}
+    return historicInterest
+
+
+def repayment_calendar(rates=None):
+    '''RepaymentCalendar built from the vendored Plan 2 table.'''
+    rates = rates if rates is not None else load_rates()
+    return RepaymentCalendar(rates["plan2_start"], rates["plan2_rate"])
+
+
+def march_rpi(rates=None):
+    '''(years, RPI) of the March 12 month RPI change that sets each year's rate.'''
+    rates = rates if rates is not None else load_rates()
+    months = rates["month"]
+    march = (months.astype(np.int64) % 12) == RATE_SET_MONTH - 1
+    return months[march].astype("datetime64[Y]").astype(np.int64) + 1970, rates["monthly"][march]
+
+
+def rpi_plus_3(rates=None):
+    '''
+    RPI + 3% for every academic year covered by the RPI series:
+    (start dates of 1 September, rates as fractions).
+    '''
+    years, rpi = march_rpi(rates)
+    starts = np.array(["%d-09-01" % year for year in years], dtype="datetime64[D]")
+    return starts, rpi + RPI_MARGIN
+
+
+def thresholds_at(dates, rates=None):
+    '''(lower, upper) Plan 2 interest income thresholds in force on dates.'''
+    rates = rates if rates is not None else load_rates()
+    i = np.searchsorted(rates["threshold_start"], np.asarray(dates, dtype="datetime64[D]"), side="right") - 1
+    i = np.clip(i, 0, len(rates["threshold_start"]) - 1)
+    return rates["threshold_lower"][i], rates["threshold_upper"][i]
+
+
+def tapered_rate(rpi, income, lower, upper):
+    '''
+    Plan 2 interest after leaving the course: RPI at or below the
+    lower income threshold, RPI + 3% at or above the upper one, and
+    tapered linearly in between. Broadcasts over numpy arrays.
+    '''
+    taper = np.clip((np.asarray(income, dtype=np.float64) - lower)/(np.asarray(upper) - lower), 0, 1)
+    return np.asarray(rpi) + RPI_MARGIN*taper
@@ -0,0 +1,149 @@
+'''
+Precomputed repayment calendar and interest rate timeline.
+
+Built once from the historicInterest lookup of academic years so that
+rate lookups are a bisection over the sorted rate-change boundaries
+rather than a scan of every date in the academic year, and so that
+the business month-end payment dates for a repayment horizon are
+generated once and shared by every simulation.
+'''
+
+from bisect import bisect_right
+
+import numpy as np
+
+DAYS_PER_YEAR = 365
+
+
+def as_day(value):
+    '''
+    Converts a date-like value (string, date, datetime, Timestamp
+    or datetime64) to a numpy datetime64 day.
+    '''
+    if isinstance(value, str):
+        value = value[:10]
+    return np.datetime64(value, 'D')
+
+
+def payment_days(employment_start, N):
+    '''
+    Days elapsed since employment start of every last working
+    day of the month (BMonthEnd) within N years of payments.
+    '''
+    start = as_day(employment_start)
+    edate = start + N*DAYS_PER_YEAR
+    months = np.arange(start.astype('datetime64[M]'), edate.astype('datetime64[M]') + 1)
+    month_ends = (months + 1).astype('datetime64[D]') - 1
+    bmonth_ends = np.busday_offset(month_ends, 0, roll='backward')
+    bmonth_ends = bmonth_ends[(bmonth_ends >= start) & (bmonth_ends <= edate)]
+    return (bmonth_ends - start).astype(np.int64)
+
+
+class RepaymentCalendar:
+    '''
+    Interest rate segments and repayment dates.
+
+    Segment i applies rates[i] from boundaries[i] up to (but not
+    including) boundaries[i+1]; the final rate is carried forward
+    indefinitely. Interest compounds daily at rate/365, and
+    cumulative compounding factors at every boundary are
+    precomputed so the growth between any two dates is two
+    bisections and a power.
+    '''
+
+    def __init__(self, boundaries, rates):
+        boundaries = np.asarray([as_day(b) for b in boundaries], dtype='datetime64[D]')
+        rates = np.asarray(rates, dtype=np.float64)
+        order = np.argsort(boundaries, kind="stable")
+        self.boundaries = boundaries[order]
+        self.rates = rates[order]
+        if len(self.boundaries) == 0:
+            raise ValueError("a repayment calendar needs at least one interest rate segment")
+
+        self._start_days = self.boundaries.astype(np.int64)
+        self._start_list = self._start_days.tolist() # plain ints for bisect
+        self.daily_growth = 1 + self.rates/DAYS_PER_YEAR
+        segment_growth = self.daily_growth[:-1]**np.diff(self._start_days)
+        self.cumulative_growth = np.concatenate([[1.0], np.cumprod(segment_growth)])
+        self._payment_days = {}
+
+    @classmethod
+    def from_historic_interest(cls, historicInterest):
+        '''
+        Builds the calendar from the dictionary of academic
+        years ({year: {"start", "end", "rate"}}) used by the notebook.
+        '''
+        years = sorted(historicInterest.values(), key=lambda year: as_day(year["start"]))
+        return cls([year["start"] for year in years], [year["rate"] for year in years])
+
+    @property
+    def key(self):
+        '''Hashable identity of the rate table, for memoisation.'''
+        return (self.boundaries.tobytes(), self.rates.tobytes())
+
+    def __eq__(self, other):
+        return isinstance(other, RepaymentCalendar) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def segment(self, date):
+        '''Index of the rate segment containing date.'''
+        i = bisect_right(self._start_list, int(as_day(date).astype(np.int64))) - 1
+        if i < 0:
+            raise KeyError("no interest rate before %s" % self.boundaries[0])
+        return i
+
+    def rate_at(self, date):
+        '''Interest rate in force on date.'''
+        return float(self.rates[self.segment(date)])
+
+    def segments(self, dates):
+        '''Vectorised segment lookup for an array of dates.'''
+        return self._segments(np.asarray(dates, dtype='datetime64[D]').astype(np.int64))
+
+    def _segments(self, days):
+        i = np.searchsorted(self._start_days, days, side="right") - 1
+        if np.any(i < 0):
+            raise KeyError("no interest rate before %s" % self.boundaries[0])
+        return i
+
+    def rates_at(self, dates):
+        '''Vectorised rate_at for an array of dates.'''
+        return self.rates[self.segments(dates)]
+
+    def compound_factor(self, dates):
+        '''
+        Product of the daily growth factors of every day from the
+        first boundary up to (not including) each of dates.
+        '''
+        days = np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+        i = self._segments(days)
+        return self.cumulative_growth[i]*self.daily_growth[i]**(days - self._start_days[i])
+
+    def growth(self, start, end):
+        '''
+        Growth of a balance compounded daily on every day in
+        [start, end); 1 when end <= start.
+        '''
+        start, end = as_day(start), as_day(end)
+        if end <= start:
+            return 1.0
+        return float(self.compound_factor(end)/self.compound_factor(start))
+
+    def payment_days(self, employment_start, N):
+        '''
+        Days since employment start of each business month-end
+        payment over an N year horizon, computed once per
+        (employment_start, N) and reused.
+        '''
+        key = (as_day(employment_start), N)
+        if key not in self._payment_days:
+            days = payment_days(employment_start, N)
+            days.setflags(write=False)
+            self._payment_days[key] = days
+        return self._payment_days[key]
+
+    def payment_dates(self, employment_start, N):
+        '''Calendar dates of the payments returned by payment_days.'''
+        return as_day(employment_start) + self.payment_days(employment_start, N)
@@ -0,0 +1,118 @@
+'''
+Binary results store.
+
+A run is a directory holding one .npy file per array plus a
+manifest.json recording the parameters the run was made with (seed,
+starting salary, rate assumptions, ...) and the shape and dtype of
+each array. .npy files are memory-mappable, so loading even a 10^7
+trajectory run is zero-copy until the data is touched.
+'''
+
+import datetime
+import json
+import os
+
+import numpy as np
+
+from student_finance.streaming import PERCENTILES
+
+MANIFEST = "manifest.json"
+TXT_RESULTS = ("end_values", "total_payments", "paid_off", "all_payments", "net_payments", "end_sim_values")
+
+
+def _jsonable(value):
+    '''Converts numpy scalars and arrays into plain json types.'''
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, (datetime.date, np.datetime64)):
+        return str(value)
+    if isinstance(value, np.ndarray):
+        return _jsonable(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def save_run(run_dir, arrays, parameters=None, summary=None):
+    '''
+    Writes each named array in arrays to run_dir/<name>.npy and a
+    manifest of the parameters, optional summary statistics and array
+    metadata. Returns the manifest.
+    '''
+    os.makedirs(run_dir, exist_ok=True)
+    manifest = {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "parameters": _jsonable(parameters or {}),
+                "arrays": {}}
+    if summary is not None:
+        manifest["summary"] = _jsonable(summary)
+    for name, array in arrays.items():
+        array = np.asarray(array)
+        np.save(os.path.join(run_dir, name + ".npy"), array, allow_pickle=False)
+        manifest["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+    with open(os.path.join(run_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def save_results(run_dir, results, parameters=None):
+    '''
+    Saves a results dict from run_monte_carlo or the batched engine:
+    every numpy array is stored, and a StreamingAggregate under
+    "aggregate" is recorded as summary statistics in the manifest,
+    with those of any per-cohort aggregates under "cohorts". A
+    TrajectoryRecorder under "trajectories" is stored as its recorded
+    months, kept paths and their trajectory numbers, with the
+    percentile bands as (percentiles x months) arrays "balance_bands"
+    and "salary_bands" whose percentiles are listed in the summary.
+    '''
+    arrays = {name: value for name, value in results.items() if isinstance(value, np.ndarray)}
+    summary = results["aggregate"].summary() if "aggregate" in results else None
+    if summary is not None and "cohorts" in results:
+        summary["cohorts"] = {name: cohort.summary() for name, cohort in results["cohorts"].items()}
+    recorder = results.get("trajectories")
+    if recorder is not None and recorder.months is not None:
+        bands = recorder.percentile_bands()
+        arrays["trajectory_months"] = recorder.months
+        arrays["trajectory_index"], arrays["trajectory_balances"], arrays["trajectory_salaries"] = recorder.trajectories()
+        arrays["balance_bands"] = np.array([bands["balances_P%d" % p] for p in PERCENTILES])
+        arrays["salary_bands"] = np.array([bands["salaries_P%d" % p] for p in PERCENTILES])
+        if summary is not None:
+            summary["band_percentiles"] = list(PERCENTILES)
+    return save_run(run_dir, arrays, parameters=parameters, summary=summary)
+
+
+def read_manifest(run_dir):
+    with open(os.path.join(run_dir, MANIFEST)) as f:
+        return json.load(f)
+
+
+def load_run(run_dir, mmap=True, names=None):
+    '''
+    Loads a run written by save_run. Returns (arrays, manifest);
+    with mmap=True (the default) the arrays are read-only memory maps.
+    names restricts loading to a subset of the arrays.
+    '''
+    manifest = read_manifest(run_dir)
+    arrays = {}
+    for name in (names or manifest["arrays"]):
+        arrays[name] = np.load(os.path.join(run_dir, name + ".npy"), mmap_mode="r" if mmap else None,
+                               allow_pickle=False)
+    return arrays, manifest
+
+
+def import_txt_results(results_dir, run_dir, parameters=None, names=TXT_RESULTS):
+    '''
+    Converts a results directory of np.savetxt files (end_values.txt,
+    total_payments.txt, ...) into a binary run. Files that are
+    missing are skipped. Returns the manifest.
+    '''
+    arrays = {}
+    for name in names:
+        path = os.path.join(results_dir, name + ".txt")
+        if os.path.exists(path):
+            arrays[name] = np.loadtxt(path, ndmin=1)
+    parameters = dict(parameters or {})
+    parameters.setdefault("imported_from", os.path.abspath(results_dir))
+    return save_run(run_dir, arrays, parameters=parameters)
@@ -0,0 +1,378 @@
+'''
+Chunked, multi-process Monte Carlo runner.
+
+The simulation count is split into fixed-size chunks, each seeded from
+its own child of a numpy SeedSequence. Chunk boundaries and seeds
+depend only on the seed and chunk size, so results are identical
+whatever the number of workers. Chunks run on a process pool and their
+results are merged as they finish.
+
+By default each chunk is reduced to a StreamingAggregate in the worker,
+so memory does not depend on the number of simulations; per-trajectory
+arrays are only kept when asked for.
+
+With profiling enabled (student_finance.profiling) the workers time
+their stages too and send the timers back with each chunk.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+import numpy as np
+
+from student_finance import profiling
+from student_finance.engine import salary_levels_needed, simulate_lifetime_earnings_batch
+from student_finance.repayment_calendar import payment_days
+from student_finance.rate_paths import band_shocks, normal_cdf
+from student_finance.salary_models import antithetic_increases, monte_carlo_increases
+from student_finance.streaming import RunningStats, StreamingAggregate
+from student_finance.trajectories import TrajectoryRecorder
+
+
+def chunks(sims, chunk_size):
+    '''(offset, size) of each chunk covering sims simulations.'''
+    return [(offset, min(chunk_size, sims - offset)) for offset in range(0, sims, chunk_size)]
+
+
+@profiling.timed("salary generation")
+def chunk_salaries(rng, size, settings):
+    '''
+    Band increases or salary matrix for one chunk: (increases,
+    salaries), one of which is None.
+    '''
+    salary_model = settings["salary_model"]
+    if salary_model is None:
+        draw = antithetic_increases if settings["antithetic"] else monte_carlo_increases
+        return draw(rng, size, salary_levels=settings["salary_levels"]), None
+    calendar = settings["calendar"]
+    if calendar is not None:
+        days = calendar.payment_days(settings["employment_start"], settings["N"])
+    else:
+        days = payment_days(settings["employment_start"], settings["N"])
+    return None, salary_model(rng, size, days)
+
+
+def chunk_draws(rng, size, settings):
+    '''
+    Every random draw of one chunk, in the order run_chunk makes them:
+    (increases, salaries, interest_rates) as in chunk_salaries, plus
+    the (size x years) rate paths of the rate model (None without one),
+    correlated with the band increases if the model asks for it.
+    '''
+    increases, salaries = chunk_salaries(rng, size, settings)
+    interest_rates = None
+    rate_model = settings["rate_model"]
+    if rate_model is not None:
+        N = settings["N"]
+        correlated = getattr(rate_model, "correlation", 0) and increases is not None
+        with profiling.stage("rate paths"):
+            shocks = band_shocks(increases, N+1, rng=rng) if correlated else None
+            interest_rates = rate_model(rng, size, N+1, salary_shocks=shocks)
+    return increases, salaries, interest_rates
+
+
+def run_chunk(seed_seq, size, settings):
+    '''
+    Simulates one chunk of size trajectories with its own random
+    generator, settings being the options of run_monte_carlo. Returns
+    the chunk's StreamingAggregate, a dict of per-cohort aggregates
+    (None unless the salary model has cohorts), with per_trajectory
+    the batched engine's results (else None) and with record the
+    chunk's TrajectoryRecorder (else None).
+    '''
+    rng = np.random.default_rng(seed_seq)
+    increases, salaries, interest_rates = chunk_draws(rng, size, settings)
+    record = settings["record"]
+    result = simulate_lifetime_earnings_batch(settings["grossSalaryPA"], settings["N"], settings["principal"],
+                                              settings["employment_start"], increases,
+                                              calendar=settings["calendar"], interest_rates=interest_rates,
+                                              salaries=salaries, stop_at_payoff=settings["stop_at_payoff"],
+                                              return_trajectories=record is not None)
+    recorder = None
+    if record is not None:
+        with profiling.stage("trajectory recording"):
+            ## the reservoir draws come after the simulation's, so recording does not change the results
+            recorder = TrajectoryRecorder(**dict(record, sims=size, seed=rng))
+            recorder.update(result.pop("balances"), result.pop("salaries"))
+
+    with profiling.stage("aggregation"):
+        aggregate_options = settings["aggregate_options"] or {}
+        aggregate = StreamingAggregate(**aggregate_options).update(result)
+        cohorts = None
+        if hasattr(settings["salary_model"], "labels"):
+            labels = settings["salary_model"].labels(size)
+            cohorts = {}
+            for i, name in enumerate(settings["salary_model"].names):
+                members = labels == i
+                cohorts[name] = StreamingAggregate(**aggregate_options).update(
+                    {key: values[members] for key, values in result.items()})
+    return aggregate, cohorts, (result if settings["per_trajectory"] else None), recorder
+
+
+def run_profiled_chunk(seed_seq, size, settings):
+    '''run_chunk in a worker process with the stage timers on, returning them as a fifth item.'''
+    profiling.enable()
+    profiling.reset()
+    return run_chunk(seed_seq, size, settings) + (profiling.snapshot(),)
+
+
+def chunk_plan(grossSalaryPA, N, principal, employment_start, sims, seed=101, chunk_size=10000,
+               salary_levels=6, calendar=None, per_trajectory=False, aggregate_options=None,
+               rate_model=None, salary_model=None, stop_at_payoff=False, antithetic=False, record=None):
+    '''
+    The chunks of a run_monte_carlo call: their (offset, size) spans,
+    seed sequences and the settings for run_chunk. Anything that runs
+    the chunks itself (e.g. a job queue) gets the same results as
+    run_monte_carlo by merging the chunk aggregates in span order.
+    '''
+    if antithetic and (salary_model is not None or chunk_size % 2):
+        raise ValueError("antithetic pairs need the band increase salary model and an even chunk_size")
+    if getattr(rate_model, "correlation", 0) and salary_model is not None:
+        raise ValueError("a rate model's correlation follows the band increase shocks, "
+                         "so it needs the default salary model")
+    if salary_model is None:
+        days = calendar.payment_days(employment_start, N) if calendar is not None else payment_days(employment_start, N)
+        if salary_levels_needed(days) > salary_levels:
+            raise ValueError("%d years need %d salary levels, got %d" % (N, salary_levels_needed(days), salary_levels))
+    spans = chunks(sims, chunk_size)
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    seeds = root.spawn(len(spans))
+    settings = {"grossSalaryPA": grossSalaryPA, "N": N, "principal": principal,
+                "employment_start": employment_start, "salary_levels": salary_levels,
+                "calendar": calendar, "per_trajectory": per_trajectory,
+                "aggregate_options": aggregate_options, "rate_model": rate_model,
+                "salary_model": salary_model, "stop_at_payoff": stop_at_payoff, "antithetic": antithetic,
+                "record": record}
+    return spans, seeds, settings
+
+
+def print_progress(done, total):
+    '''Default progress callback, printing the percentage complete.'''
+    print("current progress %.1f%% (%d of %d simulations)" % (100*done/total, done, total))
+
+
+def run_monte_carlo(grossSalaryPA, N, principal, employment_start, sims, seed=101,
+                    chunk_size=10000, workers=None, salary_levels=6, calendar=None,
+                    progress=None, per_trajectory=False, aggregate_options=None, rate_model=None,
+                    salary_model=None, stop_at_payoff=False, antithetic=False, record=None, executor=None):
+    '''
+    Runs sims Monte Carlo trajectories in chunks across a process pool.
+
+    workers defaults to the number of CPUs; workers=1 runs every
+    chunk in this process. executor, a ProcessPoolExecutor, runs the
+    chunks instead of a new pool (e.g. to reuse one across calls). progress, if given, is called as
+    progress(done, sims) each time a chunk finishes. Returns a dict
+    whose "aggregate" is the StreamingAggregate of the whole run
+    (aggregate_options are passed to its constructor). With
+    per_trajectory=True it also holds (sims,) arrays "end_values",
+    "total_payments" and "paid_off". rate_model (e.g.
+    rate_paths.BootstrapRates or AR1Rates) replaces the flat 5.5%
+    interest with a stochastic annual rate path per simulation.
+    salary_model (a salary_models model) replaces the band increases;
+    with a CohortSalaries model the result also holds "cohorts", a
+    StreamingAggregate per cohort name. stop_at_payoff runs the engine
+    in its event mode (repayment stops at payoff, the balance after N
+    years is written off); per_trajectory results then also hold
+    "payoff_month" and "written_off". antithetic draws the band
+    increases as antithetic pairs (trajectories 2i and 2i+1, so
+    chunk_size must be even); seed may also be a SeedSequence.
+
+    record, a dict of trajectories.TrajectoryRecorder options (sample,
+    every, path, ...), also captures balance and salary paths: each
+    chunk records its own and they are merged in chunk order into
+    results["trajectories"], a recorder with percentile_bands() of
+    every trajectory and a sample (or with sample=None all) of the
+    paths. Each chunk then briefly holds its full float64 paths, so
+    chunk_size bounds that memory.
+    '''
+    record = dict(record) if record is not None else None
+    path = record.pop("path", None) if record is not None else None
+    spans, seeds, settings = chunk_plan(grossSalaryPA, N, principal, employment_start, sims, seed=seed,
+                                        chunk_size=chunk_size, salary_levels=salary_levels, calendar=calendar,
+                                        per_trajectory=per_trajectory, aggregate_options=aggregate_options,
+                                        rate_model=rate_model, salary_model=salary_model,
+                                        stop_at_payoff=stop_at_payoff, antithetic=antithetic, record=record)
+    aggregate = StreamingAggregate(**(aggregate_options or {}))
+    recorder = None
+    if record is not None:
+        recorder = TrajectoryRecorder(**dict(record, sims=sims, path=path, seed=np.random.default_rng(seed)))
+    if per_trajectory:
+        end_values = np.empty(sims)
+        total_payments = np.empty(sims)
+        if stop_at_payoff:
+            payoff_month = np.empty(sims, dtype=np.int64)
+            written_off = np.empty(sims)
+
+    ## aggregates are folded in chunk order, so floating point
+    ## summation order is the same however chunks are scheduled
+    pending = {}
+    state = {"next": 0, "done": 0, "cohorts": None}
+
+    def merge(index, chunk_aggregate, chunk_cohorts, result, chunk_recorder):
+        offset, size = spans[index]
+        if per_trajectory:
+            end_values[offset:offset+size] = result["end_values"]
+            total_payments[offset:offset+size] = result["total_payments"]
+            if stop_at_payoff:
+                payoff_month[offset:offset+size] = result["payoff_month"]
+                written_off[offset:offset+size] = result["written_off"]
+        pending[index] = (chunk_aggregate, chunk_cohorts, chunk_recorder)
+        with profiling.stage("aggregation"):
+            fold()
+        state["done"] += size
+        if progress is not None:
+            progress(state["done"], sims)
+
+    def fold():
+        while state["next"] in pending:
+            chunk_aggregate, chunk_cohorts, chunk_recorder = pending.pop(state["next"])
+            aggregate.merge(chunk_aggregate)
+            if chunk_recorder is not None:
+                recorder.merge(chunk_recorder)
+            if chunk_cohorts is not None:
+                if state["cohorts"] is None:
+                    state["cohorts"] = chunk_cohorts
+                else:
+                    for name, cohort in chunk_cohorts.items():
+                        state["cohorts"][name].merge(cohort)
+            state["next"] += 1
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if len(spans) == 1 or (workers == 1 and executor is None):
+        for index, ((offset, size), seed_seq) in enumerate(zip(spans, seeds)):
+            merge(index, *run_chunk(seed_seq, size, settings))
+    else:
+        profiled = profiling.is_enabled()
+        with (nullcontext(executor) if executor is not None else ProcessPoolExecutor(max_workers=workers)) as pool:
+            futures = {pool.submit(run_profiled_chunk if profiled else run_chunk, seed_seq, size, settings): index
+                       for index, ((offset, size), seed_seq) in enumerate(zip(spans, seeds))}
+            for future in as_completed(futures):
+                result = future.result()
+                if profiled:
+                    profiling.merge(result[4])
+                merge(futures[future], *result[:4])
+
+    results = {"aggregate": aggregate}
+    if state["cohorts"] is not None:
+        results["cohorts"] = state["cohorts"]
+    if recorder is not None:
+        recorder.flush()
+        results["trajectories"] = recorder
+    if per_trajectory:
+        results["end_values"] = end_values
+        results["total_payments"] = total_payments
+        results["paid_off"] = end_values <= 0
+        if stop_at_payoff:
+            results["payoff_month"] = payoff_month
+            results["written_off"] = written_off
+    return results
+
+
+TARGETS = ("end_value_mean", "paid_off_fraction", "total_payments_mean")
+ADAPTIVE_CHUNKS = 8 # chunks per run_adaptive batch by default
+
+
+def normal_quantile(p):
+    '''Inverse of rate_paths.normal_cdf, by bisection.'''
+    low, high = -10.0, 10.0
+    for _ in range(60):
+        mid = (low + high)/2
+        if normal_cdf(mid) < p:
+            low = mid
+        else:
+            high = mid
+    return (low + high)/2
+
+
+def target_values(result, antithetic):
+    '''
+    Per-sample values of each target statistic for one batch; with
+    antithetic pairs the samples are pair averages, which are
+    independent where the trajectories of a pair are not.
+    '''
+    end_values = result["end_values"]
+    values = {"end_value_mean": end_values, "paid_off_fraction": (end_values <= 0).astype(np.float64),
+              "total_payments_mean": result["total_payments"]}
+    if antithetic:
+        values = {name: x.reshape(-1, 2).mean(axis=1) for name, x in values.items()}
+    return values
+
+
+def run_adaptive(grossSalaryPA, N, principal, employment_start, tolerance, relative=False, confidence=0.95,
+                 batch_size=10000, min_sims=20000, max_sims=1000000, seed=101, antithetic=False,
+                 targets=TARGETS, progress=None, **options):
+    '''
+    Runs batches of batch_size trajectories until the confidence
+    interval of every target statistic ("end_value_mean",
+    "paid_off_fraction", "total_payments_mean") has a half-width
+    within tolerance, or max_sims have been run. tolerance is one
+    value or a dict per target; with relative=True it is a fraction
+    of the estimate. antithetic pairs the band increase shocks (see
+    salary_models.antithetic_increases), usually shrinking the
+    intervals of the mean end value and total repaid. options are
+    passed to run_monte_carlo (workers, calendar, rate_model, ...);
+    chunk_size defaults to batch_size/ADAPTIVE_CHUNKS rounded up to an
+    even number, so each batch keeps several workers busy while the
+    results stay the same whatever their number, and one process pool
+    serves every batch.
+
+    Returns a dict with the run's "aggregate", the number of "sims"
+    it needed, whether it "converged", and per target the "estimates":
+    mean, half_width and tolerance. progress, if given, is called as
+    progress(sims, estimates) after each batch. With a record option
+    the batches' trajectories are merged into "trajectories" (with
+    sample=None its arrays have room for max_sims paths).
+    '''
+    if antithetic and batch_size % 2:
+        raise ValueError("antithetic pairs need an even batch_size")
+    tolerances = tolerance if isinstance(tolerance, dict) else {name: tolerance for name in targets}
+    z = normal_quantile(0.5 + confidence/2)
+    root = np.random.SeedSequence(seed)
+    workers = options.get("workers") or os.cpu_count() or 1
+    chunk_size = -(-batch_size//ADAPTIVE_CHUNKS) # a fixed split, so results do not depend on workers
+    options.setdefault("chunk_size", chunk_size + chunk_size % 2)
+    record = options.pop("record", None)
+    recorder = None
+    if record is not None:
+        record = dict(record)
+        recorder = TrajectoryRecorder(**dict(record, sims=max_sims, seed=np.random.default_rng(seed)))
+        record.pop("path", None)
+    pool = None
+    if workers > 1 and options.get("executor") is None:
+        pool = options["executor"] = ProcessPoolExecutor(max_workers=workers)
+    with (pool if pool is not None else nullcontext()):
+        aggregate = None
+        stats = {name: RunningStats() for name in targets}
+        sims, converged = 0, False
+        while sims < max_sims and not converged:
+            size = min(batch_size, max_sims - sims)
+            size -= size % 2 if antithetic else 0
+            if size == 0:
+                break
+            batch = run_monte_carlo(grossSalaryPA, N, principal, employment_start, size, seed=root.spawn(1)[0],
+                                    per_trajectory=True, antithetic=antithetic, record=record, **options)
+            aggregate = batch["aggregate"] if aggregate is None else aggregate.merge(batch["aggregate"])
+            if recorder is not None:
+                recorder.merge(batch["trajectories"])
+            for name, values in target_values(batch, antithetic).items():
+                if name in stats:
+                    stats[name].update(values)
+            sims += size
+
+            estimates = {}
+            for name in targets:
+                mean = stats[name].mean
+                half_width = z*stats[name].std/np.sqrt(stats[name].count) if stats[name].count > 1 else np.inf
+                limit = tolerances[name]*abs(mean) if relative else tolerances[name]
+                estimates[name] = {"mean": float(mean), "half_width": float(half_width), "tolerance": float(limit)}
+            converged = sims >= min_sims and all(e["half_width"] <= e["tolerance"] for e in estimates.values())
+            if progress is not None:
+                progress(sims, estimates)
+    results = {"aggregate": aggregate, "sims": sims, "converged": converged, "estimates": estimates,
+               "confidence": confidence, "antithetic": antithetic}
+    if recorder is not None:
+        recorder.flush()
+        results["trajectories"] = recorder
+    return results
@@ -0,0 +1,164 @@
+'''
+Salary trajectory models.
+
+Each model draws a whole (payments x sims) matrix of gross annual
+salaries on the monthly payment grid in one vectorised call, for the
+batched engine's salaries argument. The median earnings curves in
+data/real_median_{men,women}_{HE,nonHE}.csv are loaded once and
+interpolated onto the grid by age.
+'''
+
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from student_finance.engine import salary_matrix
+from student_finance.rates import DATA_DIR
+from student_finance.repayment_calendar import DAYS_PER_YEAR
+
+GENDERS = ("men", "women")
+EDUCATIONS = ("HE", "nonHE")
+COHORTS = tuple((gender, education) for gender in GENDERS for education in EDUCATIONS)
+
+
+def monte_carlo_increases(rng, sims, salary_levels=6, low=.1, high=.4, scale=.1):
+    '''
+    Draws the (salary_levels x sims) matrix of multiplicative salary
+    increases: one gaussian per 5 year band, centred on a percentage
+    that falls from high to low over the career.
+    '''
+    means = np.linspace(low, high, salary_levels)[::-1]
+    return 1 + np.vstack([rng.normal(loc=x, scale=scale, size=sims) for x in means])
+
+
+def antithetic_increases(rng, sims, salary_levels=6, low=.1, high=.4, scale=.1):
+    '''
+    monte_carlo_increases drawn as antithetic pairs: columns 2i and
+    2i+1 share one set of standard normal shocks with opposite signs.
+    With an odd sims the last column has no partner.
+    '''
+    means = np.linspace(low, high, salary_levels)[::-1]
+    z = rng.standard_normal((salary_levels, (sims + 1)//2))
+    shocks = np.empty((salary_levels, 2*z.shape[1]))
+    shocks[:, 0::2], shocks[:, 1::2] = z, -z
+    return 1 + means[:, None] + scale*shocks[:, :sims]
+
+
+@lru_cache(maxsize=None)
+def load_median_curve(gender, education, data_dir=DATA_DIR):
+    '''
+    (ages, earnings) of the real median earnings curve for a cohort,
+    sorted by age. Read from disk once per cohort.
+    '''
+    if (gender, education) not in COHORTS:
+        raise ValueError("unknown cohort %r, expected one of %r" % ((gender, education), COHORTS))
+    path = os.path.join(data_dir, "real_median_%s_%s.csv" % (gender, education))
+    curve = np.loadtxt(path, delimiter=",", ndmin=2)
+    curve = curve[np.argsort(curve[:, 0], kind="stable")]
+    ages, earnings = curve[:, 0].copy(), curve[:, 1].copy()
+    ages.setflags(write=False)
+    earnings.setflags(write=False)
+    return ages, earnings
+
+
+def median_salary(gender, education, ages):
+    '''Median earnings at ages, interpolated (and held flat beyond the data).'''
+    curve_ages, earnings = load_median_curve(gender, education)
+    return np.interp(ages, curve_ages, earnings)
+
+
+def payment_ages(starting_age, days):
+    '''Age at each payment day, days counted from employment start.'''
+    return starting_age + np.asarray(days)/DAYS_PER_YEAR
+
+
+class MedianSalary:
+    '''
+    Deterministic median earnings for a cohort from starting_age.
+    With starting_salary the curve is rescaled to pass through it at
+    employment start, keeping the shape of the median progression.
+    '''
+
+    def __init__(self, gender="men", education="HE", starting_age=22, starting_salary=None):
+        load_median_curve(gender, education) # checks the cohort (and its data) up front
+        self.gender, self.education = gender, education
+        self.starting_age = float(starting_age)
+        self.starting_salary = None if starting_salary is None else float(starting_salary)
+
+    def curve(self, days):
+        salaries = median_salary(self.gender, self.education, payment_ages(self.starting_age, days))
+        if self.starting_salary is not None:
+            salaries = salaries*self.starting_salary/median_salary(self.gender, self.education, self.starting_age)
+        return salaries
+
+    def __call__(self, rng, sims, days):
+        return np.broadcast_to(self.curve(days)[:, None], (len(days), sims)) # read-only view, no copy per sim
+
+
+class LognormalSalary(MedianSalary):
+    '''
+    Median curve with lognormal noise: a permanent individual level
+    (sigma_level) plus an independent shock each simulation year
+    (sigma_year), both mean-one so the curve stays the median path.
+    '''
+
+    def __init__(self, gender="men", education="HE", starting_age=22, starting_salary=None,
+                 sigma_level=0.2, sigma_year=0.05):
+        super().__init__(gender, education, starting_age, starting_salary)
+        self.sigma_level, self.sigma_year = float(sigma_level), float(sigma_year)
+
+    def __call__(self, rng, sims, days):
+        days = np.asarray(days)
+        years = days//DAYS_PER_YEAR
+        level = rng.normal(-self.sigma_level**2/2, self.sigma_level, size=sims)
+        yearly = rng.normal(-self.sigma_year**2/2, self.sigma_year, size=(int(years.max(initial=0)) + 1, sims))
+        return self.curve(days)[:, None]*np.exp(level[None, :] + yearly[years])
+
+
+class BandShockSalary:
+    '''
+    The notebook's Monte Carlo model: a starting salary multiplied by
+    a gaussian increase at the start of each 5 year band.
+    '''
+
+    def __init__(self, starting_salary=29000, salary_levels=6, low=.1, high=.4, scale=.1):
+        self.starting_salary = float(starting_salary)
+        self.salary_levels, self.low, self.high, self.scale = int(salary_levels), float(low), float(high), float(scale)
+
+    def increases(self, rng, sims):
+        return monte_carlo_increases(rng, sims, self.salary_levels, self.low, self.high, self.scale)
+
+    def __call__(self, rng, sims, days):
+        return salary_matrix(self.starting_salary, self.increases(rng, sims), np.asarray(days))
+
+
+class CohortSalaries:
+    '''
+    Several cohorts (e.g. gender x HE/non-HE) in one batch. Columns
+    are split between the models in proportion to weights (equal by
+    default) and labels() gives each column's cohort name.
+    '''
+
+    def __init__(self, models, weights=None):
+        self.names = list(models)
+        self.models = [models[name] for name in self.names]
+        weights = np.ones(len(self.names)) if weights is None else np.asarray([weights[n] for n in self.names], dtype=float)
+        self.weights = weights/weights.sum()
+
+    @classmethod
+    def median_cohorts(cls, cohorts=COHORTS, model=LognormalSalary, **kwargs):
+        '''One model per (gender, education) cohort, named "gender_education".'''
+        return cls({"%s_%s" % cohort: model(*cohort, **kwargs) for cohort in cohorts})
+
+    def sizes(self, sims):
+        sizes = np.floor(self.weights*sims).astype(np.int64)
+        sizes[:sims - sizes.sum()] += 1 # hand out the remainder
+        return sizes
+
+    def labels(self, sims):
+        '''Index into names of the cohort of each of sims columns.'''
+        return np.repeat(np.arange(len(self.names)), self.sizes(sims))
+
+    def __call__(self, rng, sims, days):
+        return np.hstack([model(rng, size, days) for model, size in zip(self.models, self.sizes(sims))])
@@ -0,0 +1,230 @@
+'''
+Streaming aggregation of simulation results.
+
+Summaries whose memory does not grow with the number of simulations:
+running mean and variance (Welford, with Chan's pairwise update for
+whole batches), relative-error quantile sketches, which also serve
+as histograms, and a paid-off count. Every summary can be merged with
+another built
+over a different chunk, so chunks and workers can be combined in any
+grouping.
+'''
+
+import numpy as np
+
+PERCENTILES = (5, 10, 25, 50, 75, 90, 95)
+
+
+class RunningStats:
+    '''Count, mean, variance, min and max of a stream of values.'''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.M2 = 0.0 # sum of squared deviations from the mean
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        '''Adds a batch of values.'''
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return self
+        batch = RunningStats()
+        batch.count = values.size
+        batch.mean = float(values.mean())
+        batch.M2 = float(np.sum((values - batch.mean)**2))
+        batch.min = float(values.min())
+        batch.max = float(values.max())
+        return self.merge(batch)
+
+    def merge(self, other):
+        '''Combines the statistics of other into this one.'''
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta*other.count/count
+        self.M2 += other.M2 + delta**2*self.count*other.count/count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self):
+        '''Sample variance.'''
+        return self.M2/(self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+def sketch_buckets(values, accuracy, scale):
+    '''
+    Bucket numbers of values in a relative-error sketch: buckets are
+    accuracy wide in asinh(value/scale), so each spans a fraction of
+    about accuracy of its values, or about scale*accuracy near zero.
+    '''
+    return np.floor(np.arcsinh(np.asarray(values, dtype=np.float64)/scale)/accuracy).astype(np.int64)
+
+
+def sketch_values(positions, accuracy, scale):
+    '''Inverse of sketch_buckets for fractional bucket positions.'''
+    return scale*np.sinh(np.asarray(positions, dtype=np.float64)*accuracy)
+
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch with relative accuracy, in the manner of
+    DDSketch: values are counted in buckets evenly spaced in
+    asinh(value/scale), so quantiles of values of any sign and size
+    are within a fraction accuracy (plus scale*accuracy) of the
+    truth. Buckets are only allocated between the smallest and
+    largest values seen, so there is no fixed range to overflow.
+    '''
+
+    def __init__(self, accuracy=0.002, scale=1.0):
+        self.accuracy = float(accuracy)
+        self.scale = float(scale)
+        self.offset = 0 # bucket number of counts[0]
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.stats = RunningStats()
+
+    def _extend(self, low, high):
+        '''Grows counts to cover buckets low to high.'''
+        if self.counts.size:
+            low, high = min(low, self.offset), max(high, self.offset + self.counts.size - 1)
+        counts = np.zeros(high - low + 1, dtype=np.int64)
+        start = self.offset - low
+        counts[start:start + self.counts.size] = self.counts
+        self.offset, self.counts = low, counts
+
+    def update(self, values):
+        '''Adds a batch of values.'''
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return self
+        buckets = sketch_buckets(values, self.accuracy, self.scale)
+        low, high = int(buckets.min()), int(buckets.max())
+        if not self.counts.size or low < self.offset or high >= self.offset + self.counts.size:
+            self._extend(low, high)
+        self.counts += np.bincount(buckets - self.offset, minlength=self.counts.size)
+        self.stats.update(values)
+        return self
+
+    def merge(self, other):
+        '''Adds the counts of another sketch with the same accuracy and scale.'''
+        if (self.accuracy, self.scale) != (other.accuracy, other.scale):
+            raise ValueError("can only merge sketches with identical accuracy and scale")
+        if other.counts.size:
+            self._extend(other.offset, other.offset + other.counts.size - 1)
+            start = other.offset - self.offset
+            self.counts[start:start + other.counts.size] += other.counts
+        self.stats.merge(other.stats)
+        return self
+
+    def quantile(self, q):
+        '''Approximate q-quantile (0 <= q <= 1) of the values seen.'''
+        total = self.counts.sum()
+        if total == 0:
+            return np.nan
+        if q <= 0:
+            return self.stats.min
+        if q >= 1:
+            return self.stats.max
+        cumulative = np.cumsum(self.counts)
+        target = q*total
+        i = min(int(np.searchsorted(cumulative, target, side="left")), len(self.counts) - 1)
+        below = cumulative[i-1] if i > 0 else 0
+        fraction = min(max((target - below)/self.counts[i], 0.0), 1.0)
+        value = float(sketch_values(self.offset + i + fraction, self.accuracy, self.scale))
+        return min(max(value, self.stats.min), self.stats.max)
+
+    def histogram(self, bins=None):
+        '''
+        (edges, counts) of the values seen, over the sketch's buckets
+        between the smallest and largest value: len(edges) is
+        len(counts) + 1 and bucket i holds values from edges[i] up to
+        edges[i+1]. With bins, runs of neighbouring buckets are added
+        together into at most that many bars, each of them still
+        evenly spaced in asinh(value/scale).
+        '''
+        edges = sketch_values(self.offset + np.arange(self.counts.size + 1), self.accuracy, self.scale)
+        counts = self.counts
+        if bins is not None and counts.size > bins:
+            starts = np.arange(0, counts.size, -(-counts.size//bins))
+            counts = np.add.reduceat(counts, starts)
+            edges = edges[np.append(starts, self.counts.size)]
+        return edges, counts.copy()
+
+
+class StreamingAggregate:
+    '''
+    Summary of a Monte Carlo run built chunk by chunk: running
+    statistics and quantile sketches of end values and total payments
+    (accuracy and scale are the sketches' settings), which histogram()
+    reads as histograms, and
+    the number of trajectories that paid off the loan. Results from
+    the engine's stop_at_payoff mode also feed running statistics of
+    the amount written off and of the payoff month of paid off loans.
+    '''
+
+    def __init__(self, accuracy=0.002, scale=1.0):
+        self.end_values = QuantileSketch(accuracy, scale)
+        self.total_payments = QuantileSketch(accuracy, scale)
+        self.paid_off = 0
+        self.written_off = RunningStats()
+        self.payoff_month = RunningStats()
+
+    @property
+    def count(self):
+        return self.end_values.stats.count
+
+    def update(self, results):
+        '''Adds a results dict from the batched engine.'''
+        self.end_values.update(results["end_values"])
+        self.total_payments.update(results["total_payments"])
+        self.paid_off += int(np.count_nonzero(np.asarray(results["end_values"]) <= 0))
+        if "written_off" in results:
+            self.written_off.update(results["written_off"])
+        if "payoff_month" in results:
+            months = np.asarray(results["payoff_month"])
+            self.payoff_month.update(months[months >= 0])
+        return self
+
+    def merge(self, other):
+        '''Combines an aggregate built over another chunk.'''
+        self.end_values.merge(other.end_values)
+        self.total_payments.merge(other.total_payments)
+        self.paid_off += other.paid_off
+        self.written_off.merge(other.written_off)
+        self.payoff_month.merge(other.payoff_month)
+        return self
+
+    def histogram(self, name="end_values", bins=None):
+        '''(edges, counts) of "end_values" or "total_payments", see QuantileSketch.histogram.'''
+        if name not in ("end_values", "total_payments"):
+            raise ValueError("histograms are kept of end_values and total_payments, not %r" % name)
+        return getattr(self, name).histogram(bins)
+
+    def summary(self, percentiles=PERCENTILES):
+        '''Plain dict of the headline statistics.'''
+        summary = {"sims": self.count,
+                   "paid_off": self.paid_off,
+                   "paid_off_fraction": self.paid_off/self.count if self.count else np.nan}
+        for name, sketch in (("end_value", self.end_values), ("total_payments", self.total_payments)):
+            summary[name+"_mean"] = sketch.stats.mean
+            summary[name+"_std"] = sketch.stats.std
+            summary[name+"_min"] = sketch.stats.min
+            summary[name+"_max"] = sketch.stats.max
+            for p in percentiles:
+                summary["%s_P%d" % (name, p)] = sketch.quantile(p/100)
+        if self.written_off.count:
+            summary["written_off_mean"] = self.written_off.mean
+            summary["written_off_max"] = self.written_off.max
+        if self.payoff_month.count:
+            summary["payoff_month_mean"] = self.payoff_month.mean
+            summary["payoff_month_min"] = self.payoff_month.min
+        return summary
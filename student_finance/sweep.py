@@ -0,0 +1,138 @@
+'''
+Parameter sweep over voluntary overpayment strategies.
+
+Answers the notebook's second question (should spare money go towards
+the loan?) for a whole grid of strategies at once. Every strategy is
+evaluated against the same salary and interest rate draws (common
+random numbers), so differences between strategies are not masked by
+sampling noise. The draws are made chunk by chunk with the runner's
+seeding (runner.chunk_draws), so they are those of a run_monte_carlo
+run with the same seed, and within a chunk all strategies advance
+together as a (strategies x sims) balance array, compounded by the
+engine's interest step (engine.compounder).
+
+A strategy is a dict with a "name" and any of:
+
+    lump_sum, lump_sum_date   one-off voluntary payment, made on the
+                              first payment date on or after the date
+    extra_monthly             voluntary payment added to every
+                              monthly repayment
+    threshold                 annual repayment threshold in place of
+                              the current one (e.g. a frozen or raised
+                              threshold)
+
+Payments stop once a trajectory's balance is repaid, and whatever is
+left after N years is written off.
+'''
+
+import numpy as np
+
+from student_finance.engine import REPAYMENT_RATE, THRESHOLD_PM, compounder, salary_matrix
+from student_finance.repayment_calendar import as_day, payment_days
+from student_finance.runner import chunk_draws, chunk_plan
+from student_finance.streaming import PERCENTILES
+
+
+STRATEGY_KEYS = ("name", "lump_sum", "lump_sum_date", "extra_monthly", "threshold")
+
+
+def strategy_arrays(strategies, employment_start, days):
+    '''
+    Per-strategy threshold, extra monthly payment, lump sum and lump
+    sum payment index. Raises ValueError for an unknown strategy key
+    or a lump sum dated outside employment start to the last payment.
+    '''
+    start = as_day(employment_start)
+    for s in strategies:
+        unknown = set(s) - set(STRATEGY_KEYS)
+        if unknown:
+            raise ValueError("strategy %r: unknown settings %s, expected %s"
+                             % (s.get("name"), ", ".join(sorted(unknown)), ", ".join(STRATEGY_KEYS)))
+    thresholds = np.array([s.get("threshold", THRESHOLD_PM*12) for s in strategies], dtype=np.float64)
+    extra = np.array([s.get("extra_monthly", 0.0) for s in strategies], dtype=np.float64)
+    lump = np.array([s.get("lump_sum", 0.0) for s in strategies], dtype=np.float64)
+    lump_index = np.full(len(strategies), -1)
+    for i, s in enumerate(strategies):
+        if s.get("lump_sum"):
+            day = (as_day(s.get("lump_sum_date", start)) - start).astype(np.int64)
+            if not 0 <= day <= days[-1]:
+                raise ValueError("strategy %r: lump_sum_date must be from %s to %s, the last payment"
+                                 % (s["name"], start, start + np.timedelta64(int(days[-1]), "D")))
+            lump_index[i] = np.searchsorted(days, day) # first payment on or after the date
+    return thresholds, extra, lump, lump_index
+
+
+def sweep_overpayments(strategies, grossSalaryPA, N, principal, employment_start, sims=10000, seed=101,
+                       salary_levels=6, salary_model=None, rate_model=None, interest_rate=0.055,
+                       calendar=None, percentiles=PERCENTILES, chunk_size=10000):
+    '''
+    Evaluates every strategy on the same sims salary (and, with a
+    rate_model, interest rate) trajectories in one batched pass.
+
+    The trajectories are drawn chunk by chunk exactly as
+    run_monte_carlo draws them (runner.chunk_plan), so for the same
+    seed and chunk_size a strategy without overpayments repays what
+    run_monte_carlo(..., stop_at_payoff=True) does, trajectory for
+    trajectory.
+
+    Returns a dict keyed by strategy name, each holding (sims,) arrays
+    "total_repaid" (compulsory plus voluntary), "voluntary",
+    "written_off" and "paid_off", and a "summary" of the distribution
+    of total repaid.
+    '''
+    names = [s["name"] for s in strategies]
+    if len(set(names)) != len(names):
+        raise ValueError("strategy names must be unique")
+
+    ## shared work: payment calendar and strategy settings; the salary
+    ## and interest rate draws are shared within each chunk
+    days = calendar.payment_days(employment_start, N) if calendar is not None else payment_days(employment_start, N)
+    thresholds, extra, lump, lump_index = strategy_arrays(strategies, employment_start, days)
+    thresholds_pm = thresholds[:, None]/12
+    extra, lump = extra[:, None], lump[:, None]
+    spans, seeds, settings = chunk_plan(grossSalaryPA, N, principal, employment_start, sims, seed=seed,
+                                        chunk_size=chunk_size, salary_levels=salary_levels, calendar=calendar,
+                                        rate_model=rate_model, salary_model=salary_model, stop_at_payoff=True)
+
+    shape = (len(strategies), sims)
+    balance = np.empty(shape)
+    compulsory = np.empty(shape)
+    voluntary = np.empty(shape)
+    for (offset, size), seed_seq in zip(spans, seeds):
+        increases, salaries, interest_rates = chunk_draws(np.random.default_rng(seed_seq), size, settings)
+        if salaries is None:
+            salaries = salary_matrix(grossSalaryPA, increases, days)
+        compound = compounder(days, interest_rate, interest_rates)
+        chunk = slice(offset, offset + size)
+        balance[:, chunk] = float(principal)
+        compulsory[:, chunk] = 0.0
+        voluntary[:, chunk] = 0.0
+        chunk_balance, chunk_compulsory, chunk_voluntary = balance[:, chunk], compulsory[:, chunk], voluntary[:, chunk]
+        for j in range(len(days)):
+            compound(chunk_balance, j)
+
+            salary_pm = salaries[j][None, :]/12
+            due = np.where(salary_pm > thresholds_pm, REPAYMENT_RATE*(salary_pm - thresholds_pm), 0.0)
+            paid = np.minimum(due, np.maximum(chunk_balance, 0.0))
+            chunk_balance -= paid
+            chunk_compulsory += paid
+
+            extra_paid = np.minimum(extra, np.maximum(chunk_balance, 0.0))
+            lumps = np.where((lump_index == j)[:, None], lump, 0.0)
+            extra_paid += np.minimum(lumps, np.maximum(chunk_balance - extra_paid, 0.0))
+            chunk_balance -= extra_paid
+            chunk_voluntary += extra_paid
+
+    results = {}
+    for i, name in enumerate(names):
+        total = compulsory[i] + voluntary[i]
+        written_off = np.maximum(balance[i], 0.0)
+        paid_off = balance[i] <= 0
+        summary = {"mean": float(total.mean()), "std": float(total.std(ddof=1)) if sims > 1 else np.nan,
+                   "mean_voluntary": float(voluntary[i].mean()), "mean_written_off": float(written_off.mean()),
+                   "paid_off_fraction": float(paid_off.mean())}
+        for p, value in zip(percentiles, np.percentile(total, percentiles)):
+            summary["P%d" % p] = float(value)
+        results[name] = {"total_repaid": total, "voluntary": voluntary[i], "written_off": written_off,
+                         "paid_off": paid_off, "summary": summary}
+    return results